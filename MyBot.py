@@ -2,22 +2,36 @@
 
 import hlt
 from hlt import constants
+from hlt import snapshot
+from hlt import trace
 from copy import deepcopy
 from datetime import datetime
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
 import math
 from math import ceil, floor
 from statistics import mean
-from heapq import nlargest
+from heapq import nlargest, heappush, heappushpop, heappop, heapify
+from functools import lru_cache
 import gc
+import tracemalloc
+import multiprocessing
+from multiprocessing import shared_memory
+import atexit
+from array import array
+import hashlib
+import json
+import os
+import struct
 
 gc.disable()
 
-GAME = hlt.Game()
-MAP = GAME.game_map
-ME = GAME.me
-OTHER_PLAYERS = [GAME.players[oid] for oid in GAME.others]
+# the state of the game being played. set for each game by BotContext
+START_TIME = None  # when the bot started reading the game
+GAME = None
+MAP = None
+ME = None
+OTHER_PLAYERS = []
 
 TURNS_REMAINING = 0
 ENDGAME = False
@@ -29,8 +43,8 @@ OPPONENT_NS = []
 TOTAL_N = 0
 
 DROPOFFS = set()
-DROPOFF_RADIUS = 8 if constants.NUM_PLAYERS == 2 else 4
-DROPOFF_COST_MULT = 5 if constants.NUM_PLAYERS == 2 else 3
+DROPOFF_RADIUS = 0  # 8 in 2 player games, 4 in 4 player games
+DROPOFF_COST_MULT = 0  # 5 in 2 player games, 3 in 4 player games
 OPPONENT_DROPOFFS = []
 DROPOFF_BY_POS = {}  # the closest dropoff for each position
 DROPOFF_DIST_BY_POS = {}  # the distance to the closest dropoff for each position
@@ -42,20 +56,72 @@ EXTRACT_MULTIPLIER_BY_POS = {}  # the extraction multiplier for each position
 BONUS_MULTIPLIER_BY_POS = {}  # the bonus multiplier for each position
 DIFFICULTY = {}  # the difficulty of getting to a position
 
-SIZE = constants.WIDTH * constants.HEIGHT
-HALF_SIZE = SIZE // 2
-TOTAL_HALITE = sum(MAP[p].halite_amount for p in MAP.positions)
-HALITE_REMAINING = TOTAL_HALITE
-PCT_REMAINING = HALITE_REMAINING / TOTAL_HALITE
-PCT_COLLECTED = 1 - PCT_REMAINING
-REMAINING_WEIGHT = constants.NUM_OPPONENTS + PCT_REMAINING
-COLLECTED_WEIGHT = constants.NUM_OPPONENTS + PCT_COLLECTED
+SIZE = 0
+HALF_SIZE = 0
+FLAT_POSITIONS = []  # index y * WIDTH + x
+DIRECTION_BETWEEN = {}  # (pos, neighbor) -> direction
+SPAWN_COMMAND = hlt.commands.GENERATE.encode()
+MOVE_BYTES = {}  # (pos, neighbor) -> the engine's byte for the move
+MAP_TABLES = {}  # (width, height) -> FLAT_POSITIONS, DIRECTION_BETWEEN & MOVE_BYTES, shared between BotContexts
+STATIC_TABLES = {}  # StaticTables.name -> its sections, shared between BotContexts
+NEIGHBORS = None  # 5 flat indices per position: its neighbors in constants.ALL_DIRECTIONS order, see StaticTables
+KERNELS = {}  # radius -> the positions within radius of each position & where each one's start, see StaticTables
+STATIC_TABLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 '.static_tables')  # where StaticTables are cached, None to build them every game
+TOTAL_HALITE = 0
+HALITE_REMAINING = 0
+PCT_REMAINING = 1
+PCT_COLLECTED = 0
+REMAINING_WEIGHT = 0
+COLLECTED_WEIGHT = 0
 
 ROI = 0
 
 MAX_ASSIGNMENTS = 100 * 100
-
-PROB_OCCUPIED = {}
+REGION_SIZE = 4  # the width & height of the regions ResourceAllocation.assignments prunes with
+INCREMENTAL_ALLOCATION = False  # whether ships keep last turn's goal while it is still good
+FULL_ALLOCATION_INTERVAL = 10  # every this many turns all the ships are allocated from scratch
+HIERARCHICAL_ALLOCATION = False  # assign ships to regions first, then to positions in their region
+COARSE_REGION_SIZE = 8  # the width & height of the regions ResourceAllocation.hierarchical_assignments uses
+ALLOCATION_SOLVER = 'greedy'  # 'greedy' or 'auction', see ResourceAllocation.goals_for_ships
+AUCTION_EPSILON = 0.01  # the minimum bid increment of ResourceAllocation.auction
+
+PROB_OCCUPIED = {}  # the probability of an opponent ship being at each position next turn
+NGRAM_PREDICTION = False  # whether OpponentModel learns each opponent's moves
+NGRAM_CONTEXT = 2  # the number of previous moves OpponentModel predicts a ship's next move from
+NGRAM_MIN_OBSERVATIONS = 20  # the times a context has to be seen before it's used to predict
+NGRAM_MIN_PROBABILITY = 0.05  # moves less likely than this aren't predicted
+DIRECTION_INDEX = {d: i for i, d in enumerate(constants.ALL_DIRECTIONS)}
+OCCUPANCY = []  # by time step in the A* window, the probability of an opponent ship being at each position
+
+MEMOIZE_HPT = False  # whether to memoize IncomeEstimation.hpt_of within a turn
+HPT_CACHE_SIZE = 2 ** 18  # the most IncomeEstimation.hpt_of results kept in a turn
+SHIP_BUCKET_SIZE = 8  # the width & height of the buckets ships are counted in, see PathPlanning.next_positions_for
+BUCKET_DIST_RANGES = {}  # memoized bucket_dist_ranges
+MINING_SCHEDULES = {}  # memoized mining schedules, see IncomeEstimation.mining_schedule
+MAX_MINING_SCHEDULES = 100000
+COLLECT_EACH_TURN = True  # run the garbage collector after sending each turn's commands
+MEMORY_TELEMETRY = False  # trace the memory used each turn (TRACE_MEMORY), or log it and what allocated it with TRACE off
+MEMORY_TOP_ALLOCATORS = 5  # the number of lines that allocated the most logged each turn with MEMORY_TELEMETRY & TRACE off
+SNAPSHOT_SLOW_TURNS = False  # save a TurnSnapshot of any turn that takes longer than SLOW_TURN_SECONDS, ~1ms a turn
+SLOW_TURN_SECONDS = 1.5
+TRACE = False  # record the bot's decisions to the BotContext's trace_path, see hlt/trace.py
+TRACE_CAPACITY = 2 ** 14  # the most trace events kept in a turn
+TRACE_EVENTS = [  # the trace events & their fields, in the order of the TRACE_ constants below
+    ('turn', ['ships', 'halite', 'spawned', 'dropoffs', 'ms']),
+    ('ship', ['ship', 'x', 'y', 'halite', 'goal_x', 'goal_y', 'mining_time', 'next_x', 'next_y', 'fallbacks']),
+    ('dropoff', ['ship', 'x', 'y', 'cost']),
+    ('opponent_model', ['predictions', 'correct', 'covered']),
+    ('memory', ['rss', 'collected', 'rss_after', 'allocated']),
+]
+TRACE_TURN, TRACE_SHIP, TRACE_DROPOFF, TRACE_OPPONENT_MODEL, TRACE_MEMORY = range(len(TRACE_EVENTS))
+TRACER = None  # the TraceBuffer, kept when TRACE is on
+PLANNING_WINDOW = 8  # the time steps PathPlanning.a_star checks reservations for, at most 64 with PARALLEL_PLANNING
+PARALLEL_PLANNING = False  # plan groups of ships that can't interact in worker processes
+PLANNING_WORKERS = 0  # the number of worker processes, 0 for one per core
+PLANNING_POOL = None  # the worker processes, see PathPlanning.pool
+WORLD_TURN = -1  # the turn a worker process last loaded the SNAPSHOT for, see PathPlanning.load_world
+SNAPSHOT = None  # the GameStateSnapshot worker processes read, kept when PARALLEL_PLANNING is on
 
 
 def main():
@@ -64,20 +130,286 @@ def main():
         commander.run_once()
 
 
+class BotContext:
+    """
+    The state of one game. The bot keeps the game it's playing in module globals (& the game's constants are in
+    hlt.constants), so a context keeps its own copy of them and activate() swaps them in. Only one context is active
+    at a time, but any number can exist, so one process can play many games: each Commander activates its context at
+    the start of its turn.
+
+    Tables that only depend on the map (FLAT_POSITIONS, DIRECTION_BETWEEN, MOVE_BYTES & the StaticTables) are shared
+    between the contexts playing on the same size of map.
+
+    Once the game has started what's been made for it is frozen (see freeze & MemoryManagement). close() ends the
+    game and unfreezes it, so a process playing game after game doesn't keep them all, e.g.
+
+        with BotContext(hlt.Game(start)) as context:
+            commander = Commander(context, send)
+            ...
+
+    Swapping contexts isn't thread safe: the module globals & hlt.constants are shared, so games can only be played
+    from one thread at a time.
+    """
+    GLOBALS = ['START_TIME', 'GAME', 'MAP', 'ME', 'OTHER_PLAYERS', 'TURNS_REMAINING', 'ENDGAME', 'SHIPS', 'N',
+               'OTHER_SHIPS', 'OPPONENT_NS', 'TOTAL_N', 'DROPOFFS', 'DROPOFF_RADIUS', 'DROPOFF_COST_MULT',
+               'OPPONENT_DROPOFFS', 'DROPOFF_BY_POS', 'DROPOFF_DIST_BY_POS', 'OPPONENTS_AROUND', 'ALLIES_AROUND',
+               'INSPIRED_BY_POS', 'EXTRACT_MULTIPLIER_BY_POS', 'BONUS_MULTIPLIER_BY_POS', 'DIFFICULTY', 'SIZE',
+               'HALF_SIZE', 'FLAT_POSITIONS', 'DIRECTION_BETWEEN', 'MOVE_BYTES', 'NEIGHBORS', 'KERNELS',
+               'TOTAL_HALITE', 'HALITE_REMAINING', 'PCT_REMAINING', 'PCT_COLLECTED', 'REMAINING_WEIGHT',
+               'COLLECTED_WEIGHT', 'ROI', 'PROB_OCCUPIED', 'OCCUPANCY', 'MINING_SCHEDULES', 'TRACER', 'PLANNING_POOL',
+               'SNAPSHOT']
+    EMPTY = {name: globals()[name] for name in GLOBALS}  # the globals before any game has started
+    active = None
+    defaults = {}  # the module's own value of each setting any context has changed
+
+    def __init__(self, game, start_time=None, config=None, trace_path=None):
+        """
+        Starts a game, and makes it the active one. Has to be made right after the hlt.Game, while hlt.constants are
+        still that game's.
+        :param game: hlt.Game
+        :param start_time: when the game started being read
+        :param config: dict of settings (e.g. PLANNING_WINDOW) -> the value to play this game with. only settings
+        that are read while playing can be changed, not ones read when the module is imported
+        :param trace_path: where to write the trace with TRACE on, by default trace-<start time>-<player id>.bin so
+        games run one after another in the same directory don't overwrite each other's
+        """
+        self.constants = {name: value for name, value in vars(constants).items() if name.isupper()}
+        self.config = config or {}
+        if BotContext.active is not None:
+            BotContext.active.deactivate()
+        self.apply_config()
+        BotContext.start(game, start_time or datetime.now())
+        self.trace_path = trace_path or 'trace-{:%Y%m%d-%H%M%S-%f}-{}.bin'.format(START_TIME, ME.id)
+        self.state = None
+        self.save()
+        BotContext.active = self
+
+    @staticmethod
+    def read():
+        """
+        :return: a BotContext for the game the engine sends on stdin
+        """
+        start_time = datetime.now()
+        return BotContext(hlt.Game(), start_time)
+
+    @staticmethod
+    def start(game, start_time):
+        """
+        Sets the module globals for the start of a game.
+        :param game:
+        :param start_time:
+        :return:
+        """
+        global START_TIME, GAME, MAP, ME, OTHER_PLAYERS, TURNS_REMAINING, ENDGAME, SHIPS, N, OTHER_SHIPS, OPPONENT_NS
+        global TOTAL_N, DROPOFFS, DROPOFF_RADIUS, DROPOFF_COST_MULT, OPPONENT_DROPOFFS, DROPOFF_BY_POS
+        global DROPOFF_DIST_BY_POS, OPPONENTS_AROUND, ALLIES_AROUND, INSPIRED_BY_POS, EXTRACT_MULTIPLIER_BY_POS
+        global BONUS_MULTIPLIER_BY_POS, DIFFICULTY, SIZE, HALF_SIZE, FLAT_POSITIONS, DIRECTION_BETWEEN, MOVE_BYTES
+        global NEIGHBORS, KERNELS, TOTAL_HALITE, HALITE_REMAINING, PCT_REMAINING, PCT_COLLECTED, REMAINING_WEIGHT
+        global COLLECTED_WEIGHT, ROI, PROB_OCCUPIED, OCCUPANCY, MINING_SCHEDULES, TRACER, PLANNING_POOL, SNAPSHOT
+
+        START_TIME = start_time
+        GAME = game
+        MAP = GAME.game_map
+        ME = GAME.me
+        OTHER_PLAYERS = [GAME.players[oid] for oid in GAME.others]
+
+        TURNS_REMAINING = 0
+        ENDGAME = False
+
+        SHIPS = []
+        N = 0
+        OTHER_SHIPS = []
+        OPPONENT_NS = []
+        TOTAL_N = 0
+
+        DROPOFFS = set()
+        DROPOFF_RADIUS = 8 if constants.NUM_PLAYERS == 2 else 4
+        DROPOFF_COST_MULT = 5 if constants.NUM_PLAYERS == 2 else 3
+        OPPONENT_DROPOFFS = []
+        DROPOFF_BY_POS = {}
+        DROPOFF_DIST_BY_POS = {}
+
+        OPPONENTS_AROUND = {}
+        ALLIES_AROUND = {}
+        INSPIRED_BY_POS = {}
+        EXTRACT_MULTIPLIER_BY_POS = {}
+        BONUS_MULTIPLIER_BY_POS = {}
+        DIFFICULTY = {}
+
+        SIZE = constants.WIDTH * constants.HEIGHT
+        HALF_SIZE = SIZE // 2
+        FLAT_POSITIONS, DIRECTION_BETWEEN, MOVE_BYTES = BotContext.map_tables(constants.WIDTH, constants.HEIGHT)
+        NEIGHBORS = None
+        KERNELS = {}
+        TOTAL_HALITE = sum(MAP[p].halite_amount for p in MAP.positions)
+        HALITE_REMAINING = TOTAL_HALITE
+        PCT_REMAINING = HALITE_REMAINING / TOTAL_HALITE
+        PCT_COLLECTED = 1 - PCT_REMAINING
+        REMAINING_WEIGHT = constants.NUM_OPPONENTS + PCT_REMAINING
+        COLLECTED_WEIGHT = constants.NUM_OPPONENTS + PCT_COLLECTED
+
+        ROI = 0
+        PROB_OCCUPIED = {}
+        OCCUPANCY = []
+        MINING_SCHEDULES = {}
+        TRACER = None
+        PLANNING_POOL = None
+        SNAPSHOT = None
+
+    @staticmethod
+    def map_tables(width, height):
+        """
+        Memoized, so the contexts playing on the same size of map share them.
+        :param width:
+        :param height:
+        :return: FLAT_POSITIONS, DIRECTION_BETWEEN & MOVE_BYTES for the size of map
+        """
+        key = width, height
+        if key not in MAP_TABLES:
+            flat_positions = [(x, y) for y in range(height) for x in range(width)]
+            direction_between = {((x, y), ((x + dx) % width, (y + dy) % height)): (dx, dy)
+                                 for x, y in flat_positions for dx, dy in constants.ALL_DIRECTIONS}
+            byte_by_direction = {d: hlt.Direction.convert(d).encode() for d in constants.ALL_DIRECTIONS}
+            move_bytes = {positions: byte_by_direction[d] for positions, d in direction_between.items()}
+            MAP_TABLES[key] = flat_positions, direction_between, move_bytes
+        return MAP_TABLES[key]
+
+    def save(self):
+        """
+        Keeps the module globals as they are now in this context.
+        :return:
+        """
+        module = globals()
+        self.state = {name: module[name] for name in BotContext.GLOBALS}
+
+    def apply_config(self):
+        module = globals()
+        for name, value in self.config.items():
+            BotContext.defaults.setdefault(name, module[name])
+            module[name] = value
+
+    def deactivate(self):
+        """
+        Keeps the module globals in this context, and puts back the settings it changed.
+        :return:
+        """
+        self.save()
+        globals().update({name: BotContext.defaults[name] for name in self.config})
+
+    def activate(self):
+        """
+        Swaps this context's game & settings into the module globals & hlt.constants, keeping the active context's
+        first. hlt.constants are always swapped in, since bots loaded from other copies of this module share them.
+        :return:
+        """
+        vars(constants).update(self.constants)
+        if BotContext.active is self:
+            return
+        if BotContext.active is not None:
+            BotContext.active.deactivate()
+        self.apply_config()
+        globals().update(self.state)
+        BotContext.active = self
+
+    @staticmethod
+    def freeze():
+        """
+        Freezes everything made so far (the map, precomputed tables), so the garbage collector never looks at it again.
+        Called once the game has started.
+        :return:
+        """
+        gc.collect()
+        gc.freeze()
+
+    def close(self):
+        """
+        Ends the game: closes its trace, snapshot & worker processes, puts the module globals back as they were before
+        any game, and unfreezes what freeze froze so the game can be collected once nothing refers to it. gc.freeze is
+        for the whole process, so other contexts' games are unfrozen too, until the next game started freezes them.
+        :return:
+        """
+        global TRACER, SNAPSHOT, PLANNING_POOL
+        self.activate()
+        if TRACER is not None:
+            atexit.unregister(TRACER.close)
+            TRACER.close()
+        if PLANNING_POOL is not None:
+            PLANNING_POOL.terminate()
+        if SNAPSHOT is not None:
+            atexit.unregister(SNAPSHOT.close)
+            SNAPSHOT.close(unlink=True)
+        globals().update({name: BotContext.defaults[name] for name in self.config})
+        globals().update(BotContext.EMPTY)
+        self.state = None
+        BotContext.active = None
+        gc.unfreeze()
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 class Commander:
-    def __init__(self):
-        GAME.ready("AllYourTurtles")
+    def __init__(self, context=None, send=None):
+        """
+        :param context: the BotContext of the game to play, by default the one the engine sends on stdin
+        :param send: called with each turn's commands, encoded. by default they're sent to the engine on stdout
+        """
+        self.context = context if context is not None else BotContext.read()
+        self.context.activate()
+        cached = StaticTables.load()
+        if send is None:
+            GAME.ready("AllYourTurtles")
+        self.send = send if send is not None else hlt.networking.send_encoded
+        logging.info('[{}] startup took {:.0f} ms, static tables {}'.format(
+            datetime.now(), 1000 * (datetime.now() - START_TIME).total_seconds(), 'cached' if cached else 'built'))
         self.opponent_model = OpponentModel()
-
-    def run_once(self):
-        GAME.update_frame()
+        self.halite_accounting = HaliteAccounting()
+        self.allocation = {}
+        self.encoder = CommandEncoder()
+        if PARALLEL_PLANNING:
+            global SNAPSHOT
+            SNAPSHOT = GameStateSnapshot()
+            atexit.register(SNAPSHOT.close, unlink=True)
+        if TRACE:
+            global TRACER
+            TRACER = trace.TraceBuffer(self.context.trace_path, TRACE_EVENTS, TRACE_CAPACITY)
+            atexit.register(TRACER.close)
+        self.context.freeze()
+        self.memory = MemoryManagement()
+
+    def run_once(self, frame=None):
+        """
+        Plays a turn.
+        :param frame: the turn's hlt.networking.Frame, read from the engine on stdin if not given
+        :return:
+        """
+        self.context.activate()
+        GAME.update_frame(frame)
+        # captured before the turn's timed, so a slow turn is slow without it, see TurnSnapshot for what it costs
+        turn_snapshot = TurnSnapshot.capture(self) if SNAPSHOT_SLOW_TURNS else None
+        start_time = datetime.now()
+        if TRACER is not None:
+            TRACER.turn = GAME.turn_number
         self.update_globals()
-        # TOOD this should've been above update_globals
-        # start_time = datetime.now()
+        self.memory.phase('update')
         # log('Starting turn {}'.format(GAME.turn_number))
         queue = self.produce_commands()
-        GAME.end_turn(queue)
-        # log('Turn took {}'.format((datetime.now() - start_time).total_seconds()))
+        self.send(CommandEncoder.encode(queue))
+        turn_time = (datetime.now() - start_time).total_seconds()
+        if turn_snapshot is not None and turn_time > SLOW_TURN_SECONDS:
+            snapshot.save('snapshot-{}-{}.bin'.format(ME.id, GAME.turn_number), turn_snapshot)
+        if TRACER is not None:
+            TRACER.add(TRACE_TURN, N, ME.halite_amount, queue.count(SPAWN_COMMAND),
+                       sum(command.startswith(b'c') for command in queue), 1000 * turn_time)
+            TRACER.drain()
+        self.memory.end_turn()
+        if GAME.turn_number == 1:
+            logging.info('[{}] first turn took {:.0f} ms'.format(datetime.now(), 1000 * turn_time))
+        # log('Turn took {}'.format(turn_time))
 
     def update_globals(self):
         """
@@ -88,9 +420,12 @@ class Commander:
         global DROPOFFS, OPPONENT_DROPOFFS, DROPOFF_BY_POS, DROPOFF_DIST_BY_POS
         global OPPONENTS_AROUND, ALLIES_AROUND, INSPIRED_BY_POS, EXTRACT_MULTIPLIER_BY_POS, BONUS_MULTIPLIER_BY_POS
         global HALITE_REMAINING, PCT_REMAINING, PCT_COLLECTED, DIFFICULTY, REMAINING_WEIGHT, COLLECTED_WEIGHT
-        global PROB_OCCUPIED, ROI
+        global PROB_OCCUPIED, OCCUPANCY, ROI
 
         # log('Updating data...')
+        # if MEMOIZE_HPT:
+        #     log('hpt_of cache: {}'.format(IncomeEstimation.hpt_of.cache_info()))
+        IncomeEstimation.memoize(MEMOIZE_HPT)
 
         TURNS_REMAINING = constants.MAX_TURNS - GAME.turn_number
         SHIPS = ME.get_ships()
@@ -104,7 +439,9 @@ class Commander:
         # log('N={} ON={}'.format(N, OPPONENT_NS))
 
         self.opponent_model.update_all()
-        prob_by_pos = self.opponent_model.prob_occupied()
+        occupancy_layers = self.opponent_model.occupancy(PLANNING_WINDOW)
+        OCCUPANCY = [dict(zip(FLAT_POSITIONS, layer)) for layer in occupancy_layers]
+        PROB_OCCUPIED = OCCUPANCY[1]
 
         OPPONENTS_AROUND = defaultdict(int)
         ALLIES_AROUND = defaultdict(int)
@@ -123,11 +460,13 @@ class Commander:
             for drp in player.get_dropoffs():
                 OPPONENT_DROPOFFS.append(drp.pos)
 
-        halite = 0
+        inspired_positions = {p for p, n in OPPONENTS_AROUND.items() if n >= constants.INSPIRATION_SHIP_COUNT}
+        self.halite_accounting.update(MAP.changed_halite, inspired_positions)
+
         for pos in MAP.positions:
             drp = min(DROPOFFS, key=lambda drp: MAP.dist(drp, pos))
             drp_dist = MAP.dist(pos, drp)
-            inspired = OPPONENTS_AROUND[pos] >= constants.INSPIRATION_SHIP_COUNT
+            inspired = pos in inspired_positions
             extract = constants.INSPIRED_EXTRACT_MULTIPLIER if inspired else constants.EXTRACT_MULTIPLIER
             bonus = constants.INSPIRED_BONUS_MULTIPLIER if inspired else 0
             DROPOFF_BY_POS[pos] = drp
@@ -136,10 +475,8 @@ class Commander:
             EXTRACT_MULTIPLIER_BY_POS[pos] = extract
             BONUS_MULTIPLIER_BY_POS[pos] = bonus
             DIFFICULTY[pos] = 0
-            halite += MAP[pos].halite_amount * (1 + bonus)
-            PROB_OCCUPIED[pos] = prob_by_pos[pos]
-        HALITE_REMAINING = halite
-        PCT_REMAINING = halite / TOTAL_HALITE
+        HALITE_REMAINING = self.halite_accounting.remaining()
+        PCT_REMAINING = HALITE_REMAINING / TOTAL_HALITE
         PCT_COLLECTED = 1 - PCT_REMAINING
         REMAINING_WEIGHT = constants.NUM_OPPONENTS + PCT_REMAINING
         COLLECTED_WEIGHT = constants.NUM_OPPONENTS + PCT_COLLECTED
@@ -155,6 +492,9 @@ class Commander:
 
         ROI = IncomeEstimation.roi()
 
+        if SNAPSHOT is not None:
+            SNAPSHOT.write(occupancy_layers)
+
         # log('Updated data')
 
     def should_make_ship(self, goals):
@@ -185,10 +525,11 @@ class Commander:
         2. Maybe spawn ship
         3. Plan paths
 
-        :return:
+        :return: the commands, as bytes for CommandEncoder.encode
         """
-        goals, mining_times, planned_dropoffs, costs = ResourceAllocation.goals_for_ships(
-            self.opponent_model.get_next_positions())
+        goals, mining_times, planned_dropoffs, costs, self.allocation = ResourceAllocation.goals_for_ships(
+            self.opponent_model.get_next_positions(), self.allocation)
+        self.memory.phase('allocation')
         # log('allocated goals: {}'.format(goals))
 
         halite_available = ME.halite_amount
@@ -199,28 +540,72 @@ class Commander:
             spawning = True
             # log('spawning')
 
-        next_positions = PathPlanning.next_positions_for(self.opponent_model, goals, mining_times, spawning)
+        next_positions, fallbacks = PathPlanning.next_positions_for(self.opponent_model, goals, mining_times,
+                                                                    spawning)
+        self.memory.phase('planning')
         # log('planned paths: {}'.format(next_positions))
+        if TRACER is not None:
+            for i in range(N):
+                goal = goals[i] if goals[i] is not None else (-1, -1)
+                next_pos = next_positions[i] if next_positions[i] is not None else (-1, -1)
+                TRACER.add(TRACE_SHIP, SHIPS[i].id, *SHIPS[i].pos, SHIPS[i].halite_amount, *goal, mining_times[i],
+                           *next_pos, fallbacks[i])
 
         commands = []
         if spawning:
-            commands.append(ME.shipyard.spawn())
+            commands.append(SPAWN_COMMAND)
         for i in range(N):
             if next_positions[i] is not None:
-                commands.append(SHIPS[i].move(direction_between(SHIPS[i].pos, next_positions[i])))
+                commands.append(self.encoder.move(SHIPS[i].id, SHIPS[i].pos, next_positions[i]))
             else:
                 cost = constants.DROPOFF_COST - SHIPS[i].halite_amount - MAP[SHIPS[i].pos].halite_amount
                 if halite_available >= cost:
-                    commands.append(SHIPS[i].make_dropoff())
+                    commands.append(self.encoder.make_dropoff(SHIPS[i].id))
                     halite_available -= cost
                     # log('Making dropoff with {}'.format(SHIPS[i]))
+                    if TRACER is not None:
+                        TRACER.add(TRACE_DROPOFF, SHIPS[i].id, *SHIPS[i].pos, cost)
                     planned_dropoffs.remove(SHIPS[i].pos)
                 else:
-                    commands.append(SHIPS[i].stay_still())
+                    commands.append(self.encoder.move(SHIPS[i].id, SHIPS[i].pos, SHIPS[i].pos))
 
         return commands
 
 
+class CommandEncoder:
+    """
+    Makes the commands sent to the engine as bytes, without formatting anything per ship each turn: each ship's
+    'm <id> ' prefix is made the first time it's seen, and the direction byte is looked up in MOVE_BYTES.
+    """
+
+    def __init__(self):
+        self._move_prefixes = {}
+
+    def move(self, ship_id, pos, next_pos):
+        """
+        :param ship_id:
+        :param pos: where the ship is
+        :param next_pos: pos or a position next to it
+        :return: bytes
+        """
+        prefix = self._move_prefixes.get(ship_id)
+        if prefix is None:
+            prefix = self._move_prefixes[ship_id] = '{} {} '.format(hlt.commands.MOVE, ship_id).encode()
+        return prefix + MOVE_BYTES[(pos, next_pos)]
+
+    @staticmethod
+    def make_dropoff(ship_id):
+        return '{} {}'.format(hlt.commands.CONSTRUCT, ship_id).encode()
+
+    @staticmethod
+    def encode(commands):
+        """
+        :param commands: list of bytes
+        :return: the whole turn as bytes, to send in one write
+        """
+        return b' '.join(commands) + b'\n'
+
+
 class IncomeEstimation:
     @staticmethod
     def hpt_of(turns_remaining, turns_to_move, turns_to_dropoff, halite_on_board, space_left, halite_on_ground,
@@ -233,6 +618,10 @@ class IncomeEstimation:
         Doesn't accurately model mining time.
         Assumes ships will collect all the halite in the square.
 
+        Lots of ships have the same cargo and lots of squares have the same halite, so this can be memoized with
+        MEMOIZE_HPT: each turn Commander.update_globals points hpt_of at memoized_hpt_of or unmemoized_hpt_of (see
+        memoize), and clears the cache.
+
         :param turns_remaining: int
         :param turns_to_move: int
         :param turns_to_dropoff: int
@@ -285,6 +674,63 @@ class IncomeEstimation:
 
         return collect_hpt + dropoff_bonus, gained, time
 
+    unmemoized_hpt_of = hpt_of
+    memoized_hpt_of = staticmethod(lru_cache(maxsize=HPT_CACHE_SIZE)(hpt_of.__func__))
+
+    @staticmethod
+    def memoize(enabled):
+        """
+        Points hpt_of at the memoized version, with an empty cache, or the plain one. Done at the start of each turn
+        rather than when the class is made, so MEMOIZE_HPT can be changed while the bot is running (e.g. by a
+        BotContext's config).
+        :param enabled: whether to memoize
+        :return:
+        """
+        if enabled:
+            IncomeEstimation.hpt_of = IncomeEstimation.__dict__['memoized_hpt_of']
+            IncomeEstimation.hpt_of.cache_clear()
+        else:
+            IncomeEstimation.hpt_of = IncomeEstimation.__dict__['unmemoized_hpt_of']
+
+    @staticmethod
+    def mining_schedule(space_left, halite_on_ground, extract_multiplier, bonus_multiplier):
+        """
+        What happens turn by turn when a ship sits on a square and mines until it is full or the square is empty.
+
+        This only depends on the starting state, so it is memoized.
+
+        :param space_left: int
+        :param halite_on_ground: int
+        :param extract_multiplier: float
+        :param bonus_multiplier: float
+        :return: list of (halite on board, space left, halite on ground, halite gained by mining) for each turn
+        """
+        key = space_left, halite_on_ground, extract_multiplier, bonus_multiplier
+        schedule = MINING_SCHEDULES.get(key)
+        if schedule is not None:
+            return schedule
+
+        schedule = []
+        while True:
+            # the halite gained by mining from here, the same way hpt_of figures it out
+            amount_gained = min(halite_on_ground, space_left)
+            inspiration_gained = min(halite_on_ground * bonus_multiplier, space_left - amount_gained)
+            schedule.append((constants.MAX_HALITE - space_left, space_left, halite_on_ground,
+                             amount_gained + inspiration_gained))
+            if space_left <= 0 or halite_on_ground <= 0:
+                break
+
+            extracted = min(ceil(halite_on_ground * extract_multiplier), space_left)
+            halite_on_ground -= extracted
+
+            extracted *= 1 + bonus_multiplier
+            space_left = max(space_left - extracted, 0)
+
+        if len(MINING_SCHEDULES) >= MAX_MINING_SCHEDULES:
+            MINING_SCHEDULES.clear()
+        MINING_SCHEDULES[key] = schedule
+        return schedule
+
     @staticmethod
     def time_spent_mining(turns_to_dropoff, space_left, halite_on_ground, runner_up_assignment, extract_multiplier,
                           bonus_multiplier):
@@ -292,6 +738,9 @@ class IncomeEstimation:
         Figures out how long a ship will mine at a square for. A ship will mine until there's a more valuable
         position to be at.
 
+        Searches the mining schedule for the first turn where staying is worth less than the runner up assignment or
+        than turning in.
+
         :param turns_to_dropoff: int
         :param space_left: int
         :param halite_on_ground: int
@@ -300,22 +749,40 @@ class IncomeEstimation:
         :param bonus_multiplier: float
         :return:
         """
-        t = 0
-        while space_left > 0 and halite_on_ground > 0:
-            halite = constants.MAX_HALITE - space_left
-            hpt, _, _ = IncomeEstimation.hpt_of(TURNS_REMAINING - t, 0, turns_to_dropoff, halite,
-                                                space_left, halite_on_ground, halite_on_ground * bonus_multiplier)
-            if hpt < runner_up_assignment[0] or hpt < halite / (turns_to_dropoff + 1):
-                return t, halite_on_ground
-
-            extracted = min(ceil(halite_on_ground * extract_multiplier), space_left)
-            halite_on_ground -= extracted
+        schedule = IncomeEstimation.mining_schedule(space_left, halite_on_ground, extract_multiplier,
+                                                    bonus_multiplier)
+        end = len(schedule) - 1
+        runner_up_hpt = runner_up_assignment[0]
+        dropoff_bonus = 1 / (turns_to_dropoff + 1)
 
-            extracted *= 1 + bonus_multiplier
-            space_left = max(space_left - extracted, 0)
-            t += 1
+        def done_at(t):
+            # same as hpt_of with turns_to_move = 0
+            halite, _, _, gained = schedule[t]
+            if turns_to_dropoff > TURNS_REMAINING - t:
+                hpt = 0
+            elif turns_to_dropoff == 0:
+                hpt = halite
+            else:
+                hpt = gained / 1 + dropoff_bonus
+            return hpt < runner_up_hpt or hpt < halite / (turns_to_dropoff + 1)
+
+        start = 0
+        if turns_to_dropoff > 0:
+            # while we can still make it to the dropoff, the hpt only goes down and the halite on board only goes up.
+            # so once we are done we stay done, and the first turn we are done at can be binary searched for.
+            lo, hi = 0, min(end, TURNS_REMAINING - turns_to_dropoff + 1)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if done_at(mid):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            start = lo
 
-        return t, halite_on_ground
+        for t in range(start, end):
+            if done_at(t):
+                return t, schedule[t][2]
+        return end, schedule[end][2]
 
     @staticmethod
     def roi():
@@ -355,20 +822,26 @@ class IncomeEstimation:
 
 class ResourceAllocation:
     @staticmethod
-    def goals_for_ships(opponent_next_positions):
+    def goals_for_ships(opponent_next_positions, previous_allocation):
         """
         The first main part of the bot, assigns ships to positions:
 
-            1. Get all possible assignments (ResourceAllocation.assignments)
-            2. while there are still unscheduled ships
-                2a. greedily take the best assignment
-                2b. modify any remaining assignments to that same position (i.e. reduce their value)
-            3. figure out if we want to make dropoffs
-            4. assign ships to dropoffs
-            5. redirect ships turning in to new dropoffs
+            1. Get all possible assignments (ResourceAllocation.assignments, or
+               ResourceAllocation.hierarchical_assignments with HIERARCHICAL_ALLOCATION)
+            2. keep last turn's goals that are still valid (ResourceAllocation.kept_goals) & reserve their positions
+            3. while there are still unscheduled ships
+                3a. greedily take the best assignment (or the solved assignments first, see ALLOCATION_SOLVER)
+                3b. modify any remaining assignments to that same position (i.e. reduce their value)
+            4. figure out if we want to make dropoffs
+            5. assign ships to dropoffs
+            6. redirect ships turning in to new dropoffs
+
+        Step 2 only happens with INCREMENTAL_ALLOCATION, and every FULL_ALLOCATION_INTERVAL turns every ship is
+        allocated from scratch anyway.
 
         :param opponent_next_positions:
-        :return: goals for ships, mining times for ships, planned dropoffs, costs of dropoffs
+        :param previous_allocation: the allocation returned last turn
+        :return: goals for ships, mining times for ships, planned dropoffs, costs of dropoffs, allocation
         """
         # TODO if we have way more ships than opponent ATTACK
         goals = [DROPOFF_BY_POS[SHIPS[i].pos] for i in range(N)]
@@ -376,26 +849,32 @@ class ResourceAllocation:
         scheduled = [False] * N
 
         if ENDGAME:
-            return goals, mining_times, [], []
+            return goals, mining_times, [], [], {}
 
         unscheduled = set(range(N))
 
         # log('building assignments')
-        assignments = ResourceAllocation.assignments(unscheduled)
+        if HIERARCHICAL_ALLOCATION:
+            assignments = ResourceAllocation.hierarchical_assignments(unscheduled)
+        else:
+            assignments = ResourceAllocation.assignments(unscheduled)
 
         # log('sorting assignments')
         assignments.sort(reverse=True)
 
-        # log('gathering assignments')
         reservations_by_pos = defaultdict(int)
         halite_by_pos = {}
-        while len(assignments) > 0:
-            # pick the best assignment left & assign it
-            hpt, i, pos, gained, distance, time = assignments[0]
+
+        def take(i, pos, next_best):
+            """
+            Assigns ship i to pos, reserving pos for the time it will spend mining there.
+            :param i: the ship
+            :param pos: the position
+            :param next_best: the ship's next best assignment
+            :return: the halite that will be left on pos
+            """
             goals[i] = pos
             scheduled[i] = True
-            it = filter(lambda a: a[1] == i, assignments)
-            _, next_best = next(it), next(it)
 
             # figure out the time spent mining so we can adjust the other assignments for this position
             # this allows us to reserve the position for a certain amount of time and figure out how much halite
@@ -411,23 +890,73 @@ class ResourceAllocation:
             else:
                 reservations_by_pos[pos] += mining_times[i] + 1
                 halite_by_pos[pos] = halite_on_ground
+            return halite_on_ground
 
-            # keep every other assignment, modifying the assignments that are for the same position
+        def rescore(assignments, halite_on_ground_by_pos):
+            """
+            Keeps the assignments of unscheduled ships, modifying the assignments for positions that were just taken.
+            :param assignments: the assignments
+            :param halite_on_ground_by_pos: the halite left on each of the positions just taken
+            :return: the assignments left, sorted from best to worst
+            """
             new_assignments = []
-            inspiration_bonus = halite_on_ground * BONUS_MULTIPLIER_BY_POS[pos]
-            reservations = reservations_by_pos[pos]
-            dropoff_dist = DROPOFF_DIST_BY_POS[pos]
-            for a in filter(lambda a: a[1] != i, assignments):
-                if a[2] == pos:
+            for a in assignments:
+                if scheduled[a[1]]:
+                    continue
+                if a[2] in halite_on_ground_by_pos:
                     # recalculate the value of this assignment
                     old_hpt, a_i, a_pos, a_gained, a_dist, a_time = a
+                    halite_on_ground = halite_on_ground_by_pos[a_pos]
                     new_hpt, gained, time = IncomeEstimation.hpt_of(
-                        TURNS_REMAINING, a_dist + reservations, dropoff_dist, SHIPS[a_i].halite_amount,
-                        SHIPS[a_i].space_left, halite_on_ground, inspiration_bonus)
-                    new_assignments.append((new_hpt, a_i, a_pos, gained, a_dist, time))
-                else:
-                    new_assignments.append(a)
-            assignments = sorted(new_assignments, reverse=True)
+                        TURNS_REMAINING, a_dist + reservations_by_pos[a_pos], DROPOFF_DIST_BY_POS[a_pos],
+                        SHIPS[a_i].halite_amount, SHIPS[a_i].space_left, halite_on_ground,
+                        halite_on_ground * BONUS_MULTIPLIER_BY_POS[a_pos])
+                    a = (new_hpt, a_i, a_pos, gained, a_dist, time)
+                new_assignments.append(a)
+            return sorted(new_assignments, reverse=True)
+
+        if INCREMENTAL_ALLOCATION and GAME.turn_number % FULL_ALLOCATION_INTERVAL != 0:
+            # log('keeping goals')
+            kept = ResourceAllocation.kept_goals(previous_allocation, assignments, opponent_next_positions)
+            for i, (pos, mining_time) in kept.items():
+                goals[i] = pos
+                mining_times[i] = mining_time
+                scheduled[i] = True
+                schedule = IncomeEstimation.mining_schedule(
+                    SHIPS[i].space_left, halite_by_pos.get(pos, MAP[pos].halite_amount),
+                    EXTRACT_MULTIPLIER_BY_POS[pos], BONUS_MULTIPLIER_BY_POS[pos])
+                reservations_by_pos[pos] += mining_time + 1
+                halite_by_pos[pos] = schedule[min(mining_time, len(schedule) - 1)][2]
+
+            # drop the kept ships' assignments, and modify the assignments to any position they are going to
+            assignments = rescore(assignments, {pos: halite_by_pos[pos] for pos, _ in kept.values()})
+
+        if ALLOCATION_SOLVER == 'auction':
+            # log('solving assignments')
+            # take the solved assignments from best to worst, so the mining times and the halite left are figured out
+            # the same way as the greedy, then modify the rest of the assignments all at once.
+            # any ship the solver left out is greedily assigned below.
+            top_two_by_ship = defaultdict(list)
+            for a in assignments:
+                if len(top_two_by_ship[a[1]]) < 2:
+                    top_two_by_ship[a[1]].append(a)
+
+            halite_on_ground_by_pos = {}
+            for hpt, i, pos, gained, distance, time in sorted(ResourceAllocation.auction(assignments), reverse=True):
+                next_best = next(a for a in top_two_by_ship[i] if a[2] != pos)
+                halite_on_ground_by_pos[pos] = take(i, pos, next_best)
+            assignments = rescore(assignments, halite_on_ground_by_pos)
+
+        # log('gathering assignments')
+        while len(assignments) > 0:
+            # pick the best assignment left & assign it
+            hpt, i, pos, gained, distance, time = assignments[0]
+            it = filter(lambda a: a[1] == i, assignments)
+            _, next_best = next(it), next(it)
+            halite_on_ground = take(i, pos, next_best)
+            assignments = rescore(assignments, {pos: halite_on_ground})
+
+        allocation = {SHIPS[i].id: (SHIPS[i].pos, goals[i], mining_times[i]) for i in range(N)}
 
         # get any dropoffs we want to make
         # log('gathering potential dropoffs')
@@ -464,19 +993,126 @@ class ResourceAllocation:
                 if goals[i] in DROPOFFS and MAP.dist(drp, SHIPS[i].pos) < DROPOFF_DIST_BY_POS[SHIPS[i].pos]:
                     goals[i] = drp
 
-        return goals, mining_times, planned_dropoffs, costs
+        return goals, mining_times, planned_dropoffs, costs, allocation
+
+    @staticmethod
+    def auction(assignments):
+        """
+        Solves for the assignments with the most total hpt, where each position gets at most one ship. Dropoffs can
+        take any number of ships.
+
+        Uses the auction algorithm: ships take turns bidding on the position worth the most to them after its price,
+        raising the price by how much better it is than their next best option, plus AUCTION_EPSILON. A ship that gets
+        outbid bids again. The result is within N * AUCTION_EPSILON of the best total.
+
+        :param assignments: the candidate assignments from ResourceAllocation.assignments
+        :return: list of the solved assignments. ships that are better off without any position are left out
+        """
+        options_by_ship = defaultdict(list)
+        for a in assignments:
+            options_by_ship[a[1]].append(a)
+
+        prices = defaultdict(float)
+        solved_by_ship = {}
+        ship_by_pos = {}
+        bidders = deque(options_by_ship)
+        while len(bidders) > 0:
+            i = bidders.popleft()
+
+            # not going anywhere is worth 0
+            best, second, best_a = 0, 0, None
+            for a in options_by_ship[i]:
+                value = a[0] if a[2] in DROPOFFS else a[0] - prices[a[2]]
+                if value > best:
+                    best, second, best_a = value, best, a
+                elif value > second:
+                    second = value
+            if best_a is None:
+                continue
+
+            solved_by_ship[i] = best_a
+            pos = best_a[2]
+            if pos in DROPOFFS:
+                continue
+            prices[pos] += best - second + AUCTION_EPSILON
+            if pos in ship_by_pos:
+                outbid = ship_by_pos[pos]
+                del solved_by_ship[outbid]
+                bidders.append(outbid)
+            ship_by_pos[pos] = i
+
+        return list(solved_by_ship.values())
+
+    @staticmethod
+    def kept_goals(previous_allocation, assignments, opponent_next_positions):
+        """
+        Figures out which ships can keep their goal from last turn. A ship keeps its goal unless:
+
+            1. it is done mining there, or is full
+            2. the halite there changed and it wasn't us mining it
+            3. another ship is on it, or an opponent might be next turn
+            4. the ship has a better assignment now, or another ship that isn't keeping its goal values it more
+
+        :param previous_allocation: dict of ship id -> (position, goal, mining time) from last turn
+        :param assignments: all the assignments, sorted from best to worst
+        :param opponent_next_positions:
+        :return: dict of ship index -> (goal, mining time)
+        """
+        kept = {}
+        for i in range(N):
+            ship = SHIPS[i]
+            if ship.id not in previous_allocation:
+                continue
+            last_pos, goal, mining_time = previous_allocation[ship.id]
+            if goal not in DROPOFFS:
+                if ship.pos == goal and last_pos == goal:
+                    # we mined here last turn
+                    if mining_time <= 0:
+                        continue
+                    mining_time -= 1
+                elif goal in MAP.changed_halite:
+                    continue
+                if ship.space_left == 0:
+                    continue
+                if goal in opponent_next_positions and MAP.dist(ship.pos, goal) <= 1:
+                    continue
+            if MAP[goal].is_occupied and MAP[goal].ship != ship:
+                continue
+            kept[i] = goal, mining_time
+
+        # the value of every kept goal, and the best value for each ship & each position otherwise
+        hpt_by_ship = {}
+        for i, (goal, _) in kept.items():
+            ship = SHIPS[i]
+            halite_on_ground = MAP[goal].halite_amount
+            d = MAP.dist(ship.pos, goal) + DIFFICULTY[goal]
+            hpt_by_ship[i], _, _ = IncomeEstimation.hpt_of(
+                TURNS_REMAINING, d, DROPOFF_DIST_BY_POS[goal], ship.halite_amount, ship.space_left, halite_on_ground,
+                halite_on_ground * BONUS_MULTIPLIER_BY_POS[goal])
+        best_by_ship = {}
+        best_by_pos = {}
+        for hpt, i, pos, _, _, _ in assignments:
+            if i not in best_by_ship:
+                best_by_ship[i] = hpt
+            if i not in kept and pos not in best_by_pos:
+                best_by_pos[pos] = hpt
+
+        return {i: kept[i] for i in kept if best_by_ship.get(i, 0) <= hpt_by_ship[i] and
+                best_by_pos.get(kept[i][0], 0) <= hpt_by_ship[i]}
 
     @staticmethod
     def assignments(unscheduled):
         """
         Enumerates all assignments.
 
-            1. for every position
-                1a. for every ship
-                    1ai. calculate value of sending ship here
+            1. for every ship
+                1a. for every region of the map, nearest first
+                    1ai. skip the region if even its best position can't make the ship's N largest assignments
+                    1aii. calculate value of sending ship to each position in the region
             2. take the N largest assignments for each ship, where N is ~number of ships (don't need more assignments than that)
 
-        Step 2 is key for letting us look at all possible squares instead of just nearest squares.
+        Step 2 is key for letting us look at all possible squares instead of just nearest squares. Step 1ai still
+        gives the same N largest as scoring every square, it just proves far away squares aren't worth scoring.
 
         In order to handle 64x64 with 150+ ships, I had to reduce the number of assignments per ship in step 2,
         once the number of ships gets above 100.
@@ -488,37 +1124,166 @@ class ResourceAllocation:
         :return:
         """
         # TODO don't assign to a position nearby with an enemy ship on it
-        sxs = [SHIPS[i].pos[0] for i in unscheduled]
-        sys = [SHIPS[i].pos[1] for i in unscheduled]
-        halites = [SHIPS[i].halite_amount for i in unscheduled]
-        spaces = [SHIPS[i].space_left for i in unscheduled]
+        assignments = []
+        if N == 0:
+            return assignments
+
+        max_per_ship = MAX_ASSIGNMENTS // N + 1
+        n = min(N + 1, max_per_ship)
+        # log('getting n={} largest assignments'.format(n))
+
+        regions, dropoff_cells = ResourceAllocation.regions(ResourceAllocation.candidate_positions(), REGION_SIZE)
+        most_halite = max((r[4] for r in regions), default=0)
+        closest_dropoff_dist = min((r[5] for r in regions), default=0)
+
+        dist_table = MAP.distance_table
+        for i in unscheduled:
+            sx, sy = SHIPS[i].pos
+            halite = SHIPS[i].halite_amount
+            space_left = SHIPS[i].space_left
+
+            def region_dist(region):
+                x0, x1, y0, y1 = region[:4]
+                dx = 0 if x0 <= sx <= x1 else min(dist_table[sx - x0], dist_table[sx - x1])
+                dy = 0 if y0 <= sy <= y1 else min(dist_table[sy - y0], dist_table[sy - y1])
+                return dx + dy
+
+            largest = []  # min heap of the n largest assignments so far
+
+            def score(cells):
+                for p, halite_on_ground, inspiration_bonus, dropoff_dist, difficulty in cells:
+                    d = dist_table[sx - p[0]] + dist_table[sy - p[1]] + difficulty
+                    hpt, gained, time = IncomeEstimation.hpt_of(TURNS_REMAINING, d, dropoff_dist, halite, space_left,
+                                                                halite_on_ground, inspiration_bonus)
+                    if len(largest) < n:
+                        heappush(largest, (hpt, i, p, gained, d, time))
+                    elif hpt >= largest[0][0]:
+                        heappushpop(largest, (hpt, i, p, gained, d, time))
+
+            # dropoffs are valued differently, so they are always scored
+            score(dropoff_cells)
+
+            # the hpt of a position that isn't a dropoff is at most min(space_left, halite * (1 + bonus)) / (d + 1)
+            # + 1 / (dropoff_dist + 1), so nearby regions are scored first, and any region that can't beat the n-th
+            # largest assignment so far is skipped. once even the best halite on the map can't, we are done.
+            for d, r in sorted((region_dist(region), r) for r, region in enumerate(regions)):
+                region = regions[r]
+                if len(largest) == n:
+                    worst = largest[0][0]
+                    if min(space_left, most_halite) / (d + 1) + 1 / (closest_dropoff_dist + 1) < worst:
+                        break
+                    if min(space_left, region[4]) / (d + 1) + 1 / (region[5] + 1) < worst:
+                        continue
+                score(region[6])
+
+            assignments.extend(nlargest(n, largest))
+        return assignments
+
+    @staticmethod
+    def hierarchical_assignments(unscheduled):
+        """
+        Enumerates assignments in two levels, for big maps with lots of ships where enumerating every position for
+        every ship is too slow.
+
+            1. for every ship
+                1a. for every COARSE_REGION_SIZE x COARSE_REGION_SIZE region of the map
+                    1ai. calculate value of sending ship to the best position in the region
+            2. greedily assign ships to regions, where a region can take a ship for every MAX_HALITE of halite in it
+            3. for every ship
+                3a. calculate value of sending ship to each position in its region, and to each dropoff
+
+        :param unscheduled:
+        :return:
+        """
+        assignments = []
+        if N == 0:
+            return assignments
+
+        regions, dropoff_cells = ResourceAllocation.regions(ResourceAllocation.candidate_positions(),
+                                                            COARSE_REGION_SIZE)
+        capacities = [max(sum(cell[1] + cell[2] for cell in region[6]) // constants.MAX_HALITE, 1)
+                      for region in regions]
+        best_cells = [max(region[6], key=lambda cell: cell[1] + cell[2]) for region in regions]
+
+        dist_table = MAP.distance_table
+        region_assignments = []
+        for i in unscheduled:
+            sx, sy = SHIPS[i].pos
+            halite = SHIPS[i].halite_amount
+            space_left = SHIPS[i].space_left
+            for r, (x0, x1, y0, y1, _, closest_dropoff_dist, _) in enumerate(regions):
+                dx = 0 if x0 <= sx <= x1 else min(dist_table[sx - x0], dist_table[sx - x1])
+                dy = 0 if y0 <= sy <= y1 else min(dist_table[sy - y0], dist_table[sy - y1])
+                _, halite_on_ground, inspiration_bonus, _, _ = best_cells[r]
+                hpt, _, _ = IncomeEstimation.hpt_of(TURNS_REMAINING, dx + dy, closest_dropoff_dist, halite,
+                                                    space_left, halite_on_ground, inspiration_bonus)
+                region_assignments.append((hpt, i, r))
+        region_assignments.sort(reverse=True)
+
+        region_by_ship = {}
+        best_region_by_ship = {}
+        for hpt, i, r in region_assignments:
+            best_region_by_ship.setdefault(i, r)
+            if i not in region_by_ship and capacities[r] > 0:
+                region_by_ship[i] = r
+                capacities[r] -= 1
+
+        for i in unscheduled:
+            sx, sy = SHIPS[i].pos
+            halite = SHIPS[i].halite_amount
+            space_left = SHIPS[i].space_left
+            # if there isn't enough halite to go around, ships just go to the region that's best for them
+            r = region_by_ship.get(i, best_region_by_ship[i])
+            for p, halite_on_ground, inspiration_bonus, dropoff_dist, difficulty in dropoff_cells + regions[r][6]:
+                d = dist_table[sx - p[0]] + dist_table[sy - p[1]] + difficulty
+                hpt, gained, time = IncomeEstimation.hpt_of(TURNS_REMAINING, d, dropoff_dist, halite, space_left,
+                                                            halite_on_ground, inspiration_bonus)
+                assignments.append((hpt, i, p, gained, d, time))
+        return assignments
+
+    @staticmethod
+    def candidate_positions():
+        """
+        The positions ships can be assigned to. In 4p there are so many opponent ships that positions with one on it
+        aren't worth it.
+        :return: set of positions
+        """
         positions = MAP.positions
         if constants.NUM_PLAYERS == 4:
             positions = positions - {ship.pos for ship in OTHER_SHIPS}
             positions.update(DROPOFFS)
-        P = len(positions)
-        assignments_for_ship = [[None] * P for i in unscheduled]
-        dist_table = MAP.distance_table
-        for j, p in enumerate(positions):
-            x, y = p
-            halite_on_ground = MAP[p].halite_amount
-            inspiration_bonus = halite_on_ground * BONUS_MULTIPLIER_BY_POS[p]
-            dropoff_dist = DROPOFF_DIST_BY_POS[p]
-            difficulty = DIFFICULTY[p]
-            for i in unscheduled:
-                d = dist_table[sxs[i] - x] + dist_table[sys[i] - y] + difficulty
-                hpt, gained, time = IncomeEstimation.hpt_of(TURNS_REMAINING, d, dropoff_dist, halites[i], spaces[i],
-                                                            halite_on_ground, inspiration_bonus)
-                assignments_for_ship[i][j] = (hpt, i, p, gained, d, time)
+        return positions
 
-        assignments = []
-        if N > 0:
-            max_per_ship = MAX_ASSIGNMENTS // N + 1
-            n = min(N + 1, max_per_ship)
-            # log('getting n={} largest assignments'.format(n))
-            for i in unscheduled:
-                assignments.extend(nlargest(n, assignments_for_ship[i]))
-        return assignments
+    @staticmethod
+    def regions(positions, size):
+        """
+        Splits the positions up into size x size blocks. Each region keeps the most inspiration weighted halite and the
+        closest dropoff distance of its positions, which bounds the value of any position in it.
+
+        :param positions:
+        :param size:
+        :return: list of (x0, x1, y0, y1, most halite, closest dropoff distance, cells) regions, and dropoff cells
+        """
+        cells_by_region = defaultdict(list)
+        dropoff_cells = []
+        for p in positions:
+            halite_on_ground = MAP[p].halite_amount
+            cell = (p, halite_on_ground, halite_on_ground * BONUS_MULTIPLIER_BY_POS[p], DROPOFF_DIST_BY_POS[p],
+                    DIFFICULTY[p])
+            if cell[3] == 0:
+                dropoff_cells.append(cell)
+            else:
+                cells_by_region[(p[0] // size, p[1] // size)].append(cell)
+
+        regions = []
+        for (rx, ry), cells in cells_by_region.items():
+            x0, y0 = rx * size, ry * size
+            x1 = min(x0 + size, constants.WIDTH) - 1
+            y1 = min(y0 + size, constants.HEIGHT) - 1
+            most_halite = max(cell[1] + cell[2] for cell in cells)
+            closest_dropoff_dist = min(cell[3] for cell in cells)
+            regions.append((x0, x1, y0, y1, most_halite, closest_dropoff_dist, cells))
+        return regions, dropoff_cells
 
     @staticmethod
     def get_potential_dropoffs(goals):
@@ -528,13 +1293,13 @@ class ResourceAllocation:
             1. get the X positions with the largest amount of halite on them for candidates
                 1a. if its 4p also add in positions around ships and their goals
             2. Get the dropoff score for each of these positions, and whether or not they can even be dropoffs
-            3. Remove any conflicting dropoffs, taking the one with the highest score as the winner
+            3. Remove any conflicting dropoffs, greedily taking the ones with the highest score as the winners
             4. return any remaining
 
         :param goals:
         :return:
         """
-        positions = set(nlargest(constants.WIDTH, MAP.positions, key=MAP.halite_at))
+        positions = set(MAP.largest_halite_positions(constants.WIDTH))
 
         # in 4p since there are more ships, I found i wasn't producing enough dropoffs without this.
         # i tried adding in 2p, but then was making too many dropoffs in not the best spots.
@@ -552,17 +1317,23 @@ class ResourceAllocation:
                 score_by_dropoff[pos] = score
                 goals_by_dropoff[pos] = num_goals
 
-        # only take the biggest dropoff when there are multiple nearby
-        # Note: this can actually be done in a better way if you just sort the dropoffs first, and only take a dropoff
-        #   if it doesn't conflict with any others already taken.
+        # only take the biggest dropoff when there are multiple nearby.
+        # go through the dropoffs from best to worst, and only take a dropoff if it doesn't conflict with any others
+        # already taken. winners are bucketed into a coarse grid where each bucket is at least 2 * DROPOFF_RADIUS wide,
+        # so a conflicting winner can only be in the same or a neighboring bucket.
+        conflict_dist = 2 * DROPOFF_RADIUS
+        bw = max(constants.WIDTH // conflict_dist, 1)
+        bh = max(constants.HEIGHT // conflict_dist, 1)
         winners = set()
-        for drp in score_by_dropoff:
-            conflicting_winners = {w for w in winners if MAP.dist(w, drp) < 2 * DROPOFF_RADIUS}
-            if len(conflicting_winners) == 0:
-                winners.add(drp)
-            elif all([score_by_dropoff[drp] > score_by_dropoff[w] for w in conflicting_winners]):
-                winners -= conflicting_winners
-                winners.add(drp)
+        winners_by_bucket = defaultdict(list)
+        for drp in sorted(score_by_dropoff, key=lambda drp: (-score_by_dropoff[drp], drp)):
+            bx = drp[0] * bw // constants.WIDTH
+            by = drp[1] * bh // constants.HEIGHT
+            buckets = {((bx + dx) % bw, (by + dy) % bh) for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+            if any(MAP.dist(w, drp) < conflict_dist for b in buckets for w in winners_by_bucket[b]):
+                continue
+            winners.add(drp)
+            winners_by_bucket[(bx, by)].append(drp)
 
         # select winners
         score_by_dropoff = {drp: score_by_dropoff[drp] for drp in winners}
@@ -625,186 +1396,196 @@ class PathPlanning:
 
         Uses WHCA* for each of the ships. Basically A* with a window of time where it will check a reservation table.
 
+        With PARALLEL_PLANNING the rest of the ships are split into groups that can't interact within the window, and
+        each group is planned in a worker process. The reservations made so far go in the SNAPSHOT, so each worker is
+        only sent its group's ships.
+
         :param opponent_model:
         :param goals:
         :param mining_times:
         :param spawning:
-        :return:
+        :return: the next position of each ship, and how many times A* had to fall back planning it (see
+        PathPlanner.fallbacks)
         """
-        current = [SHIPS[i].pos for i in range(N)]
-        next_positions = [current[i] for i in range(N)]
-        reservations_outnumbered = defaultdict(set)
-        reservations_self = defaultdict(set)
-        scheduled = [False] * N
-        conflicts = [0] * N
-        distances = [0 if goals[i] is None else MAP.dist(current[i], goals[i]) for i in range(N)]
-
-        # log('reserving other ship positions')
-
-        def add_reservation(pos, time, is_own, outnumbered=True):
-            """
-            Used to add reservations to the reservations table. Only reserve positions on our dropoffs if its our own
-            ship, otherwise ignore enemy ships, free halite!
-
-            :param pos:
-            :param time:
-            :param is_own:
-            :param outnumbered:
-            :return:
-            """
-            # if not a dropoff, just add
-            # if is a dropoff, add if enemy is reserving or if not endgame
-            if pos in DROPOFFS:
-                if not ENDGAME and is_own:
-                    reservations_self[time].add(pos)
-                    if outnumbered:
-                        reservations_outnumbered[time].add(pos)
-            else:
-                if outnumbered:
-                    reservations_outnumbered[time].add(pos)
-                if is_own:
-                    reservations_self[time].add(pos)
-
-        def schedule(i, pos):
-            """
-            Schedules ship i to be at position next turn. this increments our conflict counter for ships.
-            :param i:
-            :param pos:
-            :return:
-            """
-            if i is not None:
-                next_positions[i] = pos
-                scheduled[i] = True
-            for j in range(N):
-                if pos in all_neighbors(current[j]):
-                    conflicts[j] += 1
-
-        def plan_path(i):
-            """
-            Plan path for ship i
-            :param i:
-            :return:
-            """
-            my_halite = SHIPS[i].halite_amount
-
-            # add reservations for ships that are right next to us so we don't collide
-            # note: this does not add a reservation where we currently are. so other ships will still collide with us
-            # i didn't have enough time to test it, and it was too passive locally.
-            added = set()
-            for n in cardinal_neighbors(current[i]):
-                os = MAP[n].ship
-                if os is not None and os.owner != ME.id and n not in DROPOFFS:
-                    if n not in reservations_outnumbered[1] and IncomeEstimation.collision_return(my_halite,
-                                                                                                  os.halite_amount) <= 0:
-                        added.add(n)
-                        for t in range(1, 9):
-                            reservations_outnumbered[t].add(n)
-
-            # first try to plan the path only avoiding enemy ships when we are outnumbered.
-            # this means if we outnumber the opponent we don't have to worry about collisions
-            # this prevents dropoff blocking, but makes our ships collide in really dumb situations
-            # would've liked to have done this better
-            path = PathPlanning.a_star(current[i], goals[i], my_halite, reservations_outnumbered)
-            planned = True
-            if path is None:
-                # if we didn't find a path, ignore all enemy ships, and try to plan a path only avoiding our own ships
-                path = PathPlanning.a_star(current[i], goals[i], my_halite, reservations_self)
-                if path is None:
-                    # if we still didn't find a path, try with only reservations on the next time step.
-                    path = PathPlanning.a_star(current[i], goals[i], my_halite, reservations_self, window=2)
-                    if path is None:
-                        # if all else fails, just stay still, and we will probably collide with ourselves :(
-                        path = [(current[i], 0), (current[i], 1)]
-                        planned = False
-
-            # reserve our position
-            for raw_pos, t in path:
-                add_reservation(raw_pos, t, is_own=True)
-
-            # reserve our goal for the amount of time we will stay there
-            if planned and goals[i] not in DROPOFFS:
-                move_time = len(path)
-                for t in range(move_time, move_time + mining_times[i]):
-                    add_reservation(goals[i], t, is_own=True)
-            schedule(i, path[1][0])
-
-            for p in added:
-                for t in range(1, 9):
-                    reservations_outnumbered[t].remove(p)
+        planner = PathPlanner(goals, mining_times)
+        current = planner.current
 
         # add reservation if spawning
         if spawning:
-            add_reservation(ME.shipyard.pos, 1, is_own=True)
-            schedule(None, ME.shipyard.pos)
+            planner.add_reservation(ME.shipyard.pos, 1, is_own=True)
+            planner.schedule(None, ME.shipyard.pos)
 
+        # log('reserving other ship positions')
         # add reservations for enemy ship
         for opponent_ship in OTHER_SHIPS:
-            add_reservation(opponent_ship.pos, 0, is_own=False)
+            planner.add_opponent_reservation(opponent_ship.pos, 0, 1)
             # TODO roi of losing ship?
             for next_pos in opponent_model.get_next_positions_for(opponent_ship):
-                for t in range(1, 9):
-                    add_reservation(next_pos, t, is_own=False,
-                                    outnumbered=ALLIES_AROUND[next_pos] <= OPPONENTS_AROUND[next_pos])
+                planner.add_opponent_reservation(next_pos, 1, PLANNING_WINDOW + 1,
+                                                 outnumbered=ALLIES_AROUND[next_pos] <= OPPONENTS_AROUND[next_pos])
 
         # avoid enemy dropoffs, free halite if they collide with us there
         for drp in OPPONENT_DROPOFFS:
-            for t in range(0, 9):
-                add_reservation(drp, t, is_own=False)
+            planner.add_opponent_reservation(drp, 0, PLANNING_WINDOW + 1)
 
         # log('converting dropoffs')
         # schedule ships to turn into dropoffs
         for i in range(N):
             if goals[i] is None:
-                scheduled[i] = True
-                next_positions[i] = None
+                planner.scheduled[i] = True
+                planner.next_positions[i] = None
                 # add_reservation(current[i], 1, is_own=True)
 
-        unscheduled = [i for i in range(N) if not scheduled[i]]
+        unscheduled = [i for i in range(N) if not planner.scheduled[i]]
 
         # log('locking stills')
         # schedule ships to stay still
         for i in unscheduled:
             cost = floor(MAP[current[i]].halite_amount / constants.MOVE_COST_RATIO)
             if cost > SHIPS[i].halite_amount:
-                add_reservation(current[i], 1, is_own=True)
-                schedule(i, current[i])
+                planner.add_reservation(current[i], 1, is_own=True)
+                planner.schedule(i, current[i])
 
-        unscheduled = [i for i in range(N) if not scheduled[i]]
+        unscheduled = [i for i in range(N) if not planner.scheduled[i]]
 
         # log('planning stills')
         # schedule ships to stay still
         for i in unscheduled:
-            if distances[i] == 0:
-                plan_path(i)
+            if planner.distances[i] == 0:
+                planner.plan_path(i)
 
         # log('planning paths')
-        unscheduled = set(i for i in range(N) if not scheduled[i])
-        number_closer = [0] * N
+        # count the ships closer to each goal than the ship going there. ships are bucketed into a coarse grid, so
+        # whole buckets can be counted or skipped at once using the closest & farthest they can be from the goal.
+        ships_by_bucket = defaultdict(list)
+        for j in range(N):
+            ships_by_bucket[(current[j][0] // SHIP_BUCKET_SIZE, current[j][1] // SHIP_BUCKET_SIZE)].append(current[j])
+        x_ranges = bucket_dist_ranges(constants.WIDTH, SHIP_BUCKET_SIZE)
+        y_ranges = bucket_dist_ranges(constants.HEIGHT, SHIP_BUCKET_SIZE)
         for i in range(N):
             if goals[i] is not None:
-                for j in range(N):
-                    if MAP.dist(current[j], goals[i]) < distances[i]:
-                        number_closer[i] += 1
-
-        # plan the rest of the ships prioritizing this way:
-        # 1. if any ship has 4 conflicts, plan them immediately. 4 conflicts means 4 of their cardinal moves are taken up
-        # 2. plan any ships that are going to a dropoff
-        # 3. ships that are closer to their goal get planned first
-        # 4. ships that have fewer ships between them and their goal first
-        # 5. ships that have more halite get planned first
-        # 6. finally if there are still two equal ships (which there shouldn't be), order them by their id.
-        while len(unscheduled) > 0:
-            i = min(unscheduled, key=lambda i: (
-                -(conflicts[i] >= 4), -int(goals[i] in DROPOFFS), distances[i], number_closer[i],
-                -SHIPS[i].halite_amount, SHIPS[i].id))
-            plan_path(i)
-            unscheduled.remove(i)
+                gx, gy = goals[i]
+                for (bx, by), positions in ships_by_bucket.items():
+                    closest_x, farthest_x = x_ranges[gx][bx]
+                    closest_y, farthest_y = y_ranges[gy][by]
+                    if farthest_x + farthest_y < planner.distances[i]:
+                        planner.number_closer[i] += len(positions)
+                    elif closest_x + closest_y < planner.distances[i]:
+                        planner.number_closer[i] += sum(
+                            1 for p in positions if MAP.dist(p, goals[i]) < planner.distances[i])
+
+        unscheduled = [i for i in range(N) if not planner.scheduled[i]]
+        groups = PathPlanning.independent_groups(unscheduled, current) if PARALLEL_PLANNING else [unscheduled]
+        if len(groups) > 1:
+            # log('planning {} groups in parallel'.format(len(groups)))
+            world = PathPlanning.world()
+            SNAPSHOT.write_reservations(planner)
+            groups.sort(key=len, reverse=True)
+            results = PathPlanning.pool().starmap(plan_group, [(world, planner.group(group)) for group in groups])
+            for group, planned in zip(groups, results):
+                for i, (pos, fallbacks) in zip(group, planned):
+                    planner.next_positions[i] = pos
+                    planner.fallbacks[i] = fallbacks
+                    planner.scheduled[i] = True
+        else:
+            planner.plan(unscheduled)
         # log('paths planned')
 
-        return next_positions
+        return planner.next_positions, planner.fallbacks
+
+    @staticmethod
+    def independent_groups(ships, current):
+        """
+        Splits ships into groups that can't affect each other's paths. A ship only checks reservations inside the A*
+        window, where it can't get further than the window from where it is, so ships more than twice the window
+        apart never see each other's reservations.
+
+        Ships are bucketed into a grid of cells at least twice the window across, so only ships in neighboring cells
+        have to be compared.
+
+        :param ships: the indices of the ships to split
+        :param current: the positions of all the ships
+        :return: list of lists of ship indices
+        """
+        # the window a_star actually uses
+        reach = 2 * (min(PLANNING_WINDOW, 4) if N > 100 else PLANNING_WINDOW)
+        # cells are all the same size, so a short one at the edge of the map can't let ships two cells apart touch
+        columns = max(constants.WIDTH // reach, 1)
+        rows = max(constants.HEIGHT // reach, 1)
+        ships_by_cell = defaultdict(list)
+        for i in ships:
+            x, y = current[i]
+            ships_by_cell[(x * columns // constants.WIDTH, y * rows // constants.HEIGHT)].append(i)
+
+        group_of = {i: i for i in ships}
+
+        def find(i):
+            while group_of[i] != i:
+                group_of[i] = group_of[group_of[i]]
+                i = group_of[i]
+            return i
+
+        for (cx, cy), cell_ships in ships_by_cell.items():
+            neighbors = {((cx + dx) % columns, (cy + dy) % rows) for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+            for cell in neighbors:
+                # each pair of cells is looked at from both sides, so only compare each pair of ships once
+                for b in ships_by_cell.get(cell, ()):
+                    for a in cell_ships:
+                        if a < b and MAP.dist(current[a], current[b]) <= reach:
+                            group_of[find(a)] = find(b)
+
+        groups = defaultdict(list)
+        for i in ships:
+            groups[find(i)].append(i)
+        return list(groups.values())
+
+    @staticmethod
+    def world():
+        """
+        The globals the worker processes need to plan paths that aren't in the SNAPSHOT, see load_world.
+        :return:
+        """
+        return GAME.turn_number, N, DROPOFFS, ENDGAME
+
+    @staticmethod
+    def load_world(world):
+        """
+        Sets this (worker) process's globals to the ones from PathPlanning.world and the SNAPSHOT. The map & occupancy
+        are only read from the SNAPSHOT for the first group of the turn.
+        :param world:
+        :return:
+        """
+        global N, DROPOFFS, ENDGAME, OCCUPANCY, PROB_OCCUPIED, WORLD_TURN
+        turn, N, DROPOFFS, ENDGAME = world
+        if SNAPSHOT.turn[0] != turn:
+            raise ValueError('snapshot is from turn {}, expected {}'.format(SNAPSHOT.turn[0], turn))
+        if WORLD_TURN == turn:
+            return
+        WORLD_TURN = turn
+        halite = SNAPSHOT.halite
+        for y in range(constants.HEIGHT):
+            for x in range(constants.WIDTH):
+                MAP[(x, y)].halite_amount = halite[y * constants.WIDTH + x]
+        OCCUPANCY = [dict(zip(FLAT_POSITIONS, SNAPSHOT.prob_occupied[t * SIZE:(t + 1) * SIZE]))
+                     for t in range(PLANNING_WINDOW)]
+        PROB_OCCUPIED = OCCUPANCY[1]
 
     @staticmethod
-    def a_star(start, goal, starting_halite, reservation_table, window=8):
+    def pool():
+        """
+        The worker processes for PARALLEL_PLANNING. Started the first time they're needed and kept for the rest of the
+        game. They're forked, so they start with a copy of the map & constants, and read the rest of the game state
+        from the SNAPSHOT.
+        :return:
+        """
+        global PLANNING_POOL
+        if PLANNING_POOL is None:
+            PLANNING_POOL = multiprocessing.get_context('fork').Pool(PLANNING_WORKERS or None, attach_snapshot,
+                                                                     (SNAPSHOT.name,))
+        return PLANNING_POOL
+
+    @staticmethod
+    def a_star(start, goal, starting_halite, reservation_table, window=None):
         """
         windowed hierarchical cooperative a*
 
@@ -813,7 +1594,11 @@ class PathPlanning:
         less than the window.
 
         Also halite tracking has been added.
+
+        The window defaults to PLANNING_WINDOW.
         """
+        if window is None:
+            window = PLANNING_WINDOW
 
         start = normalize(start)
         goal = normalize(goal)
@@ -836,7 +1621,7 @@ class PathPlanning:
 
         # log('{} -> {}'.format(start, goal))
 
-        if start == goal and goal not in reservation_table[1]:
+        if start == goal and not reservation_table.reserved(goal, 1):
             return [(start, 0), (goal, 1)]
 
         closed_set = set()
@@ -868,7 +1653,7 @@ class PathPlanning:
                 if pos == current:
                     halite_on_ground -= amt
 
-            if current == goal and not (t < window and current in reservation_table[t]) and t > 0:
+            if current == goal and not (t < window and reservation_table.reserved(current, t)) and t > 0:
                 return PathPlanning._reconstruct_path(came_from, cpt)
 
             # log('\t\tExpanding {}. f={} g={} h={} halite={} ground={}'.format(cpt, f_score[cpt], g_score[cpt],
@@ -883,6 +1668,7 @@ class PathPlanning:
             move_cost = raw_move_cost / constants.MAX_HALITE
             nt = t + 1
             avoid_mult = 1 if nt < window else 0
+            occupancy = OCCUPANCY[min(nt, PLANNING_WINDOW - 1)]
 
             neighbors = [current]
             if raw_move_cost <= halite_left:
@@ -891,12 +1677,12 @@ class PathPlanning:
             for neighbor in neighbors:
                 npt = (neighbor, nt)
 
-                if npt in closed_set or (nt < window and neighbor in reservation_table[nt]):
+                if npt in closed_set or (nt < window and reservation_table.reserved(neighbor, nt)):
                     continue
 
                 # TODO make dist actual dist, add new score for cost, and use cost to break ties
                 dist = 1 - still_multiplier * move_cost if current == neighbor else 1 + move_cost
-                g = g_score[cpt] + dist + avoid_mult * avoidance_weight * PROB_OCCUPIED[neighbor]
+                g = g_score[cpt] + dist + avoid_mult * avoidance_weight * occupancy[neighbor]
 
                 if npt not in open_set:
                     open_set.add(npt)
@@ -926,20 +1712,726 @@ class PathPlanning:
         return list(reversed(total_path))
 
 
+class PathPlanner:
+    """
+    The state of planning this turn's paths, see PathPlanning.next_positions_for. Everything a ship's plan depends on
+    is kept here, rather than read off the ships & map, so groups of ships can be planned in worker processes.
+    """
+
+    def __init__(self, goals, mining_times):
+        self.goals = goals
+        self.mining_times = mining_times
+        self.current = [SHIPS[i].pos for i in range(N)]
+        self.halite = [SHIPS[i].halite_amount for i in range(N)]
+        self.ids = [SHIPS[i].id for i in range(N)]
+        self.next_positions = [self.current[i] for i in range(N)]
+        self.fallbacks = [-1] * N  # by ship, 0 if A* found a path first try, up to 3 if it gave up, -1 if not planned
+        # opponents are only avoided when outnumbered, so they only go in the outnumbered table's static layer
+        self.reservations_outnumbered = ReservationTable({})
+        self.reservations_self = ReservationTable()
+        self.scheduled = [False] * N
+        self.conflicts = [0] * N
+        self.distances = [0 if goals[i] is None else MAP.dist(self.current[i], goals[i]) for i in range(N)]
+        self.number_closer = [0] * N
+        self.planning_queue = []
+
+        # the ships that could move to each position, for keeping track of conflicts
+        self.ships_next_to = defaultdict(list)
+        for j in range(N):
+            for p in all_neighbors(self.current[j]):
+                self.ships_next_to[p].append(j)
+
+        # the enemy ships right next to each ship that it would lose out colliding with
+        self.threats = [[] for _ in range(N)]
+        for i in range(N):
+            for n in cardinal_neighbors(self.current[i]):
+                os = MAP[n].ship
+                if os is not None and os.owner != ME.id and n not in DROPOFFS and IncomeEstimation.collision_return(
+                        self.halite[i], os.halite_amount) <= 0:
+                    self.threats[i].append(n)
+
+    def group(self, ships):
+        """
+        Everything planning a group of ships needs besides the reservations in the SNAPSHOT, see for_group.
+        :param ships: the indices of the ships
+        :return:
+        """
+        return [(self.goals[i], self.mining_times[i], self.current[i], self.halite[i], self.ids[i], self.distances[i],
+                 self.number_closer[i], self.conflicts[i], self.threats[i]) for i in ships]
+
+    @staticmethod
+    def for_group(group):
+        """
+        Makes a planner for just a group of ships in a worker process, with the reservations made before the groups
+        were split off read from the SNAPSHOT. Ship i of the planner is the ith ship of the group.
+        :param group: from PathPlanner.group
+        :return: PathPlanner
+        """
+        planner = PathPlanner.__new__(PathPlanner)
+        (planner.goals, planner.mining_times, planner.current, planner.halite, planner.ids, planner.distances,
+         planner.number_closer, planner.conflicts, planner.threats) = map(list, zip(*group))
+        n = len(group)
+        planner.next_positions = list(planner.current)
+        planner.fallbacks = [-1] * n
+        planner.reservations_outnumbered = SharedReservationTable(SNAPSHOT.reserved_outnumbered)
+        planner.reservations_self = SharedReservationTable(SNAPSHOT.reserved_self)
+        planner.scheduled = [False] * n
+        planner.planning_queue = []
+        planner.ships_next_to = defaultdict(list)
+        for j in range(n):
+            for p in all_neighbors(planner.current[j]):
+                planner.ships_next_to[p].append(j)
+        return planner
+
+    def add_reservation(self, pos, time, is_own, outnumbered=True):
+        """
+        Used to add reservations to the reservations table. Only reserve positions on our dropoffs if its our own
+        ship, otherwise ignore enemy ships, free halite!
+
+        :param pos:
+        :param time:
+        :param is_own:
+        :param outnumbered:
+        :return:
+        """
+        # if not a dropoff, just add
+        # if is a dropoff, add if enemy is reserving or if not endgame
+        if pos in DROPOFFS:
+            if not ENDGAME and is_own:
+                self.reservations_self.add(pos, time)
+                if outnumbered:
+                    self.reservations_outnumbered.add(pos, time)
+        else:
+            if outnumbered:
+                self.reservations_outnumbered.add(pos, time)
+            if is_own:
+                self.reservations_self.add(pos, time)
+
+    def add_opponent_reservation(self, pos, start, end, outnumbered=True):
+        """
+        Reserves pos for an opponent from start up to end. Enemy ships on our dropoffs are ignored, free halite!
+
+        :param pos:
+        :param start:
+        :param end:
+        :param outnumbered:
+        :return:
+        """
+        if pos not in DROPOFFS and outnumbered:
+            self.reservations_outnumbered.add_interval(pos, start, end)
+
+    def schedule(self, i, pos):
+        """
+        Schedules ship i to be at position next turn. this increments our conflict counter for ships.
+        :param i:
+        :param pos:
+        :return:
+        """
+        if i is not None:
+            self.next_positions[i] = pos
+            self.scheduled[i] = True
+        for j in self.ships_next_to.get(pos, ()):
+            self.conflicts[j] += 1
+            if self.conflicts[j] == 4 and not self.scheduled[j]:
+                # this moves the ship up in the planning order
+                heappush(self.planning_queue, (self.priority(j), j))
+
+    def priority(self, i):
+        """
+        The planning order of ship i, lowest first. See PathPlanner.plan for details.
+        :param i:
+        :return:
+        """
+        return (-(self.conflicts[i] >= 4), -int(self.goals[i] in DROPOFFS), self.distances[i], self.number_closer[i],
+                -self.halite[i], self.ids[i])
+
+    def plan_path(self, i):
+        """
+        Plan path for ship i
+        :param i:
+        :return:
+        """
+        my_halite = self.halite[i]
+        current = self.current[i]
+        goal = self.goals[i]
+
+        # add reservations for ships that are right next to us so we don't collide
+        # note: this does not add a reservation where we currently are. so other ships will still collide with us
+        # i didn't have enough time to test it, and it was too passive locally.
+        added = set()
+        for n in self.threats[i]:
+            if not self.reservations_outnumbered.reserved(n, 1):
+                added.add(n)
+                for t in range(1, PLANNING_WINDOW + 1):
+                    self.reservations_outnumbered.add(n, t)
+
+        # first try to plan the path only avoiding enemy ships when we are outnumbered.
+        # this means if we outnumber the opponent we don't have to worry about collisions
+        # this prevents dropoff blocking, but makes our ships collide in really dumb situations
+        # would've liked to have done this better
+        path = PathPlanning.a_star(current, goal, my_halite, self.reservations_outnumbered)
+        planned = True
+        self.fallbacks[i] = 0
+        if path is None:
+            # if we didn't find a path, ignore all enemy ships, and try to plan a path only avoiding our own ships
+            path = PathPlanning.a_star(current, goal, my_halite, self.reservations_self)
+            self.fallbacks[i] = 1
+            if path is None:
+                # if we still didn't find a path, try with only reservations on the next time step.
+                path = PathPlanning.a_star(current, goal, my_halite, self.reservations_self, window=2)
+                self.fallbacks[i] = 2
+                if path is None:
+                    # if all else fails, just stay still, and we will probably collide with ourselves :(
+                    path = [(current, 0), (current, 1)]
+                    planned = False
+                    self.fallbacks[i] = 3
+
+        # reserve our position
+        for raw_pos, t in path:
+            self.add_reservation(raw_pos, t, is_own=True)
+
+        # reserve our goal for the amount of time we will stay there
+        if planned and goal not in DROPOFFS:
+            move_time = len(path)
+            for t in range(move_time, move_time + self.mining_times[i]):
+                self.add_reservation(goal, t, is_own=True)
+        self.schedule(i, path[1][0])
+
+        for p in added:
+            for t in range(1, PLANNING_WINDOW + 1):
+                self.reservations_outnumbered.remove(p, t)
+
+    def plan(self, ships):
+        """
+        Plans the given unscheduled ships, prioritizing this way:
+        1. if any ship has 4 conflicts, plan them immediately. 4 conflicts means 4 of their cardinal moves are taken up
+        2. plan any ships that are going to a dropoff
+        3. ships that are closer to their goal get planned first
+        4. ships that have fewer ships between them and their goal first
+        5. ships that have more halite get planned first
+        6. finally if there are still two equal ships (which there shouldn't be), order them by their id.
+        ships get pushed again when their priority changes, so out of date entries are skipped.
+
+        :param ships: the indices of the ships to plan
+        :return:
+        """
+        self.planning_queue.extend((self.priority(i), i) for i in ships)
+        heapify(self.planning_queue)
+        while len(self.planning_queue) > 0:
+            queued_priority, i = heappop(self.planning_queue)
+            if not self.scheduled[i] and queued_priority == self.priority(i):
+                self.plan_path(i)
+
+
+class ReservationTable:
+    """
+    Positions reserved at each time step of the A* window.
+
+    Opponent reservations are the same for the whole window, so instead of adding a position to every time step they
+    are kept as [start, end) intervals in a static layer. The static layer is built once a turn and can be shared
+    between tables. Our own ships' reservations change every step and go in the dynamic layer on top.
+    """
+
+    def __init__(self, static=None):
+        self.static = static if static is not None else {}  # pos -> list of [start, end)
+        self.dynamic = defaultdict(set)  # time -> positions
+
+    def add(self, pos, time):
+        self.dynamic[time].add(pos)
+
+    def remove(self, pos, time):
+        self.dynamic[time].remove(pos)
+
+    def add_interval(self, pos, start, end):
+        """
+        Reserves pos from start up to (not including) end in the static layer, merging touching intervals.
+        :param pos:
+        :param start:
+        :param end:
+        :return:
+        """
+        intervals = self.static.setdefault(pos, [])
+        for interval in intervals:
+            if interval[0] <= end and start <= interval[1]:
+                interval[0] = min(interval[0], start)
+                interval[1] = max(interval[1], end)
+                return
+        intervals.append([start, end])
+
+    def reserved(self, pos, time):
+        if pos in self.dynamic[time]:
+            return True
+        for start, end in self.static.get(pos, ()):
+            if start <= time < end:
+                return True
+        return False
+
+    def reserved_bits(self):
+        """
+        :return: dict of the flat index of each reserved position -> bit t set if it's reserved at time t, for the times
+        in the planning window
+        """
+        bits = defaultdict(int)
+        for pos, intervals in self.static.items():
+            for start, end in intervals:
+                for time in range(start, min(end, PLANNING_WINDOW)):
+                    bits[flat_index(pos)] |= 1 << time
+        for time, positions in self.dynamic.items():
+            if time < PLANNING_WINDOW:
+                for pos in positions:
+                    bits[flat_index(pos)] |= 1 << time
+        return bits
+
+
+class SharedReservationTable(ReservationTable):
+    """
+    A ReservationTable in a worker process, on top of the reservations made before the ships were split into groups,
+    which are read from the SNAPSHOT (see ReservationTable.reserved_bits). Only times inside the planning window can be
+    checked.
+    """
+
+    def __init__(self, shared):
+        """
+        :param shared: the SNAPSHOT's bits of reserved times for each position
+        """
+        super().__init__()
+        self.shared = shared
+
+    def reserved(self, pos, time):
+        return pos in self.dynamic[time] or self.shared[flat_index(pos)] >> time & 1 == 1
+
+
+class GameStateSnapshot:
+    """
+    The per-position game state as flat arrays in shared memory, so worker processes can read it without it being
+    pickled. Written every turn by Commander.update_globals, positions are at index y * WIDTH + x.
+
+    Arrays: halite and prob_occupied, plus turn, the turn it was last written. prob_occupied holds OCCUPANCY, time
+    step t at index t * SIZE + y * WIDTH + x. reserved_outnumbered & reserved_self hold the PathPlanner's reservations
+    before the ships are split into groups, bit t set if the position is reserved at time t (see write_reservations).
+    Only what PathPlanning.load_world reads is kept; the rest of what the workers need comes from PathPlanning.world.
+    """
+    # name, type code, largest item size first so every array is aligned
+    FIELDS = (('prob_occupied', 'd'), ('reserved_outnumbered', 'Q'), ('reserved_self', 'Q'), ('turn', 'i'),
+              ('halite', 'i'))
+    ITEM_SIZES = {'d': 8, 'Q': 8, 'i': 4}
+
+    def __init__(self, name=None):
+        """
+        :param name: the name of an existing snapshot to attach to read only, or None to create a new one
+        """
+        lengths = {field: SIZE for field, _ in self.FIELDS}
+        lengths['turn'] = 1
+        lengths['prob_occupied'] = PLANNING_WINDOW * SIZE
+        size = sum(lengths[field] * self.ITEM_SIZES[code] for field, code in self.FIELDS)
+        self._shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self._shm.name
+        self._reserved = []  # the flat indices set by the last write_reservations
+        self._written = False  # whether the whole map's halite has been written yet
+
+        offset = 0
+        for field, code in self.FIELDS:
+            nbytes = lengths[field] * self.ITEM_SIZES[code]
+            view = self._shm.buf[offset:offset + nbytes].cast(code)
+            setattr(self, field, view if name is None else view.toreadonly())
+            offset += nbytes
+
+    def write(self, occupancy_layers):
+        """
+        Copies this turn's globals into the snapshot. After the first turn only the cells the engine says changed are
+        written to halite.
+        :param occupancy_layers: the OpponentModel.occupancy the OCCUPANCY dicts were made from
+        :return:
+        """
+        positions = MAP.changed_halite if self._written else MAP.positions
+        for pos in positions:
+            self.halite[flat_index(pos)] = MAP[pos].halite_amount
+        self._written = True
+
+        for t, layer in enumerate(occupancy_layers):
+            self.prob_occupied[t * SIZE:(t + 1) * SIZE] = array('d', layer)
+        self.turn[0] = GAME.turn_number
+
+    def write_reservations(self, planner):
+        """
+        Copies the planner's reservations so far into the snapshot, clearing the last ones.
+        :param planner: PathPlanner
+        :return:
+        """
+        for i in self._reserved:
+            self.reserved_outnumbered[i] = 0
+            self.reserved_self[i] = 0
+        outnumbered = planner.reservations_outnumbered.reserved_bits()
+        own = planner.reservations_self.reserved_bits()
+        for i, bits in outnumbered.items():
+            self.reserved_outnumbered[i] = bits
+        for i, bits in own.items():
+            self.reserved_self[i] = bits
+        self._reserved = list(outnumbered.keys() | own.keys())
+
+    def close(self, unlink=False):
+        """
+        :param unlink: whether to free the shared memory as well, only the process that created it should
+        :return:
+        """
+        for field, _ in self.FIELDS:
+            getattr(self, field).release()
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class HaliteAccounting:
+    """
+    Running totals of the halite left on the map. Only the cells the engine says changed and the positions whose
+    inspiration flipped are looked at, instead of summing over the whole map every turn.
+    """
+
+    def __init__(self):
+        self.total = sum(MAP[p].halite_amount for p in MAP.positions)
+        self.inspired_total = 0  # the halite on inspired positions
+        self._inspired = set()
+
+    def update(self, changed_halite, inspired):
+        """
+        :param changed_halite: dict of position -> halite before this turn's update
+        :param inspired: set of the positions that are inspired this turn
+        :return:
+        """
+        for pos, old_halite in changed_halite.items():
+            delta = MAP[pos].halite_amount - old_halite
+            self.total += delta
+            if pos in self._inspired:
+                self.inspired_total += delta
+
+        for pos in self._inspired - inspired:
+            self.inspired_total -= MAP[pos].halite_amount
+        for pos in inspired - self._inspired:
+            self.inspired_total += MAP[pos].halite_amount
+        self._inspired = inspired
+
+    def remaining(self):
+        """
+        The halite left on the map, where inspired positions are worth their bonus as well.
+        :return: float
+        """
+        return self.total + constants.INSPIRED_BONUS_MULTIPLIER * self.inspired_total
+
+
+class MemoryManagement:
+    """
+    The garbage collector is disabled so it never pauses us in the middle of a turn. Instead everything made at
+    startup (the map, precomputed tables) is frozen so it's never looked at again (see BotContext.freeze), and a
+    collection is run after each turn's commands are sent, while we'd be waiting on the engine anyway. Without it the
+    reference cycles made every turn (closures, A* state) are never freed.
+
+    With MEMORY_TELEMETRY the turn's peak RSS over its phases, the objects collected, the RSS after collecting and the
+    bytes allocated since the last turn are recorded as a TRACE_MEMORY event. With TRACE off they're logged instead,
+    along with the RSS after each phase and the lines that allocated the most.
+    """
+
+    def __init__(self):
+        self.rss_by_phase = {}
+        self._snapshot = None
+        if MEMORY_TELEMETRY:
+            tracemalloc.start()
+            self._snapshot = tracemalloc.take_snapshot()
+
+    def phase(self, name):
+        """
+        Records the RSS at the end of a phase of the turn.
+        :param name:
+        :return:
+        """
+        if MEMORY_TELEMETRY:
+            self.rss_by_phase[name] = rss()
+
+    def end_turn(self):
+        """
+        Called once the turn's commands are sent.
+        :return:
+        """
+        collected = gc.collect() if COLLECT_EACH_TURN else 0
+        if MEMORY_TELEMETRY:
+            snapshot = tracemalloc.take_snapshot()
+            stats = snapshot.compare_to(self._snapshot, 'lineno')
+            self._snapshot = snapshot
+            rss_after = rss()
+            if TRACER is not None:
+                TRACER.add(TRACE_MEMORY, max(self.rss_by_phase.values(), default=0), collected, rss_after,
+                           sum(stat.size_diff for stat in stats))
+                return
+            logging.info('[{}] memory turn={} rss={} collected={} rss_after={}'.format(
+                datetime.now(), GAME.turn_number, self.rss_by_phase, collected, rss_after))
+            for stat in stats[:MEMORY_TOP_ALLOCATORS]:
+                logging.info('[{}] memory {}'.format(datetime.now(), stat))
+
+
+class StaticTables:
+    """
+    Tables that only depend on the map size & game constants, as flat arrays indexed like FLAT_POSITIONS:
+    - NEIGHBORS, for cardinal_neighbors & all_neighbors
+    - KERNELS, the diamonds pos_around looks up for inspiration, dropoff planning & adjacent positions
+
+    They're built the first time a map size & set of constants is seen and saved in the hlt.snapshot format under
+    STATIC_TABLES_DIR, so later games memory map them instead. A cache file that can't be read is built & saved again.
+
+    A kernel is the flat indices of every position's diamond one after another, and where each position's starts
+    ('kernel<radius>_starts', with a final entry for the end). On maps narrower than the diamond it would wrap onto
+    itself, so each position's is deduplicated.
+
+    Only tables of positions are kept. The extraction & move costs are a function of a cell's halite, which isn't
+    bounded (ships dropping cargo can push a cell past 1000), and looking one up costs the same as the division.
+    """
+    VERSION = 2  # change when what's in the tables changes, so old caches aren't used
+
+    @staticmethod
+    def radii():
+        return sorted({1, constants.INSPIRATION_RADIUS, DROPOFF_RADIUS})
+
+    @staticmethod
+    def name():
+        """
+        :return: the name of the cache file for this map size & constants
+        """
+        key = json.dumps([StaticTables.VERSION, GAME.raw_constants, StaticTables.radii()], sort_keys=True)
+        return '{}x{}-{}.bin'.format(constants.WIDTH, constants.HEIGHT, hashlib.sha1(key.encode()).hexdigest()[:16])
+
+    @staticmethod
+    def build():
+        """
+        :return: dict of sections for hlt.snapshot
+        """
+        index = {p: i for i, p in enumerate(FLAT_POSITIONS)}
+        sections = {
+            'meta': {'width': constants.WIDTH, 'height': constants.HEIGHT, 'radii': StaticTables.radii()},
+            'neighbors': array('i', (index[normalize(add(p, d))] for p in FLAT_POSITIONS
+                                     for d in constants.ALL_DIRECTIONS)),
+        }
+        for radius in StaticTables.radii():
+            offsets = [(dx, dy) for dy in range(-radius, radius + 1) for dx in range(-radius, radius + 1)
+                       if abs(dx) + abs(dy) <= radius]
+            kernel = array('i')
+            starts = array('i', [0])
+            for p in FLAT_POSITIONS:
+                kernel.extend(dict.fromkeys(index[normalize(add(p, d))] for d in offsets))
+                starts.append(len(kernel))
+            sections['kernel{}'.format(radius)] = kernel
+            sections['kernel{}_starts'.format(radius)] = starts
+        return sections
+
+    @staticmethod
+    def valid(sections):
+        """
+        Whether sections loaded from a cache file are whole tables for this map.
+        :param sections: dict from hlt.snapshot.loads
+        :return:
+        """
+        meta = sections.get('meta')
+        if not isinstance(meta, dict) or meta.get('width') != constants.WIDTH or meta.get('height') != constants.HEIGHT:
+            return False
+        neighbors = sections.get('neighbors')
+        if neighbors is None or len(neighbors) != len(constants.ALL_DIRECTIONS) * len(FLAT_POSITIONS):
+            return False
+        for radius in StaticTables.radii():
+            kernel = sections.get('kernel{}'.format(radius))
+            starts = sections.get('kernel{}_starts'.format(radius))
+            if kernel is None or starts is None or len(starts) != len(FLAT_POSITIONS) + 1 or starts[-1] != len(kernel):
+                return False
+        return True
+
+    @staticmethod
+    def load():
+        """
+        Sets NEIGHBORS & KERNELS, from the cache if it has them. Tables already loaded by another BotContext in this
+        process are shared.
+        :return: whether they were in the cache
+        """
+        global NEIGHBORS, KERNELS
+        name = StaticTables.name()
+        sections = STATIC_TABLES.get(name)
+        path = os.path.join(STATIC_TABLES_DIR, name) if STATIC_TABLES_DIR is not None else None
+        if sections is None and path is not None:
+            try:
+                sections = snapshot.load_mapped(path)
+            except (OSError, ValueError, struct.error):
+                pass
+            if sections is not None and not StaticTables.valid(sections):
+                # log('static tables cache {} is corrupt, rebuilding it'.format(path))
+                sections = None
+        cached = sections is not None
+
+        if not cached:
+            sections = StaticTables.build()
+            if path is not None:
+                try:
+                    # other bots in the same game may be writing it too
+                    os.makedirs(STATIC_TABLES_DIR, exist_ok=True)
+                    temp_path = '{}.{}'.format(path, os.getpid())
+                    snapshot.save(temp_path, sections)
+                    os.replace(temp_path, path)
+                except OSError:
+                    pass
+
+        STATIC_TABLES[name] = sections
+        NEIGHBORS = sections['neighbors']
+        KERNELS = {radius: (sections['kernel{}'.format(radius)], sections['kernel{}_starts'.format(radius)])
+                   for radius in StaticTables.radii()}
+        return cached
+
+
+class TurnSnapshot:
+    """
+    Saving & restoring everything a turn depends on, in the hlt.snapshot format: the game as hlt read it this turn,
+    plus what the bot remembers from earlier turns (the opponent model, halite accounting, last turn's allocation).
+
+    Taken before Commander.update_globals, so restoring one and running the turn again does the same thing.
+    Capturing copies the map's halite & the opponent model every turn with SNAPSHOT_SLOW_TURNS on: about 1ms a turn on
+    a 32x32 map, growing with the map's area. That's outside the turn time the bot measures, but not the engine's.
+    To restore, start the bot with hlt.snapshot.engine_input as stdin, read the frame, then call restore.
+    """
+
+    @staticmethod
+    def capture(commander):
+        """
+        :param commander:
+        :return: dict of sections for hlt.snapshot
+        """
+        model = commander.opponent_model
+        accounting = commander.halite_accounting
+        players = [GAME.players[player_id] for player_id in sorted(GAME.players)]
+        meta = {
+            'constants': GAME.raw_constants,
+            'my_id': ME.id,
+            'width': constants.WIDTH,
+            'height': constants.HEIGHT,
+            'turn': GAME.turn_number,
+            'players': [{'id': p.id, 'halite': p.halite_amount, 'shipyard': list(p.shipyard.pos)} for p in players],
+            'total_halite': TOTAL_HALITE,
+            'endgame': ENDGAME,
+            'allocation': [[ship_id, pos, goal, mining_time]
+                           for ship_id, (pos, goal, mining_time) in commander.allocation.items()],
+            'accounting': [accounting.total, accounting.inspired_total],
+            'model': {'n': model._n, 'context': NGRAM_CONTEXT, 'predictions': model.predictions,
+                      'correct': model.correct, 'covered': model.covered},
+        }
+
+        sections = {
+            'meta': meta,
+            'halite': array('i', (MAP[pos].halite_amount for pos in FLAT_POSITIONS)),
+            'ships': array('i', (v for p in players for s in p.get_ships() for v in (p.id, s.id, *s.pos,
+                                                                                      s.halite_amount))),
+            'dropoffs': array('i', (v for p in players for d in p.get_dropoffs() for v in (p.id, d.id, *d.pos))),
+            'produced': array('i', (v for p in players for ship_id in p.ships_produced for v in (p.id, ship_id))),
+            'changed_halite': array('i', (v for pos, old in MAP.changed_halite.items() for v in (*pos, old))),
+            'inspired': array('i', (v for pos in accounting._inspired for v in pos)),
+        }
+
+        # the opponent model, with -1 for positions & 2 for moves that haven't been written
+        sections['model_slots'] = array('i', (v for item in model._slot_by_id.items() for v in item))
+        sections['model_free'] = array('i', model._free_slots)
+        sections['model_length'] = array('i', model._length)
+        sections['model_pos'] = array('i', (v for pos in model._pos for v in (pos or (-1, -1))))
+        sections['model_history'] = array('i', (v for history in model._history for pos in history
+                                                for v in (pos or (-1, -1))))
+        sections['model_moves'] = array('i', (v for moves in model._moves for move in moves
+                                              for v in (move or (2, 2))))
+        sections['model_weights'] = array('d', (math.nan if weights is None else weights.get(d, math.nan)
+                                                for weights in model._weights for d in constants.ALL_DIRECTIONS))
+        sections['model_counts'] = array('i', (v for owner, counts_by_context in model._counts.items()
+                                               for context, counts in counts_by_context.items()
+                                               for v in (owner, *context, *counts)))
+        return sections
+
+    @staticmethod
+    def restore(commander, sections):
+        """
+        Restores what the bot remembers from earlier turns. GAME has to have read the snapshot's frame already.
+        :param commander:
+        :param sections: dict from hlt.snapshot.load
+        :return:
+        """
+        global TOTAL_HALITE, ENDGAME
+        meta = sections['meta']
+        TOTAL_HALITE = meta['total_halite']
+        ENDGAME = meta['endgame']
+        commander.allocation = {ship_id: (tuple(pos), None if goal is None else tuple(goal), mining_time)
+                                for ship_id, pos, goal, mining_time in meta['allocation']}
+
+        produced = sections['produced']
+        for i in range(0, len(produced), 2):
+            GAME.players[produced[i]].ships_produced.add(produced[i + 1])
+
+        changed = sections['changed_halite']
+        MAP.changed_halite = {(changed[i], changed[i + 1]): changed[i + 2] for i in range(0, len(changed), 3)}
+
+        accounting = commander.halite_accounting
+        accounting.total, accounting.inspired_total = meta['accounting']
+        inspired = sections['inspired']
+        accounting._inspired = {(inspired[i], inspired[i + 1]) for i in range(0, len(inspired), 2)}
+
+        model = OpponentModel(meta['model']['n'])
+        n = model._n
+        slots = len(sections['model_length'])
+        positions = [(x, y) if x >= 0 else None for x, y in zip(*[iter(sections['model_pos'])] * 2)]
+        history = [(x, y) if x >= 0 else None for x, y in zip(*[iter(sections['model_history'])] * 2)]
+        moves = [(dx, dy) if dx != 2 else None for dx, dy in zip(*[iter(sections['model_moves'])] * 2)]
+        weights = list(sections['model_weights'])
+        slot_by_id = sections['model_slots']
+        model._slot_by_id = {slot_by_id[i]: slot_by_id[i + 1] for i in range(0, len(slot_by_id), 2)}
+        model._free_slots = list(sections['model_free'])
+        model._length = list(sections['model_length'])
+        model._pos = positions
+        model._history = [history[slot * n:(slot + 1) * n] for slot in range(slots)]
+        model._moves = [moves[slot * n:(slot + 1) * n] for slot in range(slots)]
+        model._predicted = [None] * slots
+        model._weights = []
+        for slot in range(slots):
+            slot_weights = weights[slot * len(constants.ALL_DIRECTIONS):(slot + 1) * len(constants.ALL_DIRECTIONS)]
+            if all(math.isnan(w) for w in slot_weights):
+                model._weights.append(None)
+            else:
+                model._weights.append({d: w for d, w in zip(constants.ALL_DIRECTIONS, slot_weights)
+                                       if not math.isnan(w)})
+        context = meta['model']['context']
+        row = 1 + context + len(constants.ALL_DIRECTIONS)
+        counts = sections['model_counts']
+        for i in range(0, len(counts), row):
+            model._counts[counts[i]][tuple(counts[i + 1:i + 1 + context])] = list(counts[i + 1 + context:i + row])
+        model.predictions = meta['model']['predictions']
+        model.correct = meta['model']['correct']
+        model.covered = meta['model']['covered']
+        commander.opponent_model = model
+
+
 class OpponentModel:
     """
     A very simple opponent model. Assumes opponent will make any of the cardinal moves or stay still, unless they
     are out of halite.
 
     Gives slightly more probability to the opponent moving in the same direction they did last turn.
+
+    With NGRAM_PREDICTION it also learns each opponent's moves as the game goes: a table per player counts the move
+    made after each context of the last NGRAM_CONTEXT moves. Once a context has been seen NGRAM_MIN_OBSERVATIONS times
+    its counts predict the ship's next move, moves less likely than NGRAM_MIN_PROBABILITY aren't predicted at all and
+    the rest are weighted by how likely they are.
     """
 
     def __init__(self, n=10):
         self._n = n
-        self._pos_by_ship = {}
-        self._history_by_ship = {}
-        self._moves_by_ship = {}
-        self._predicted_by_ship = {}
+        # state is kept by slot in lists that are reused as ships die, with ring buffers for the history
+        self._slot_by_id = {}  # the live opponent ships, in the order they were first seen
+        self._free_slots = []
+        self._pos = []
+        self._history = []  # ring buffers of the last n positions
+        self._moves = []  # ring buffers of the last n moves
+        self._length = []  # the number of entries written to each slot's ring buffers
+        self._predicted = []
+        self._weights = []  # the probability of each predicted move, None when the counts are too few to go on
+        self._counts = defaultdict(dict)  # player -> context -> count of each next move, by ALL_DIRECTIONS index
+        self.predictions = 0
+        self.correct = 0  # predictions where the most likely move was made
+        self.covered = 0  # predictions where the move made was predicted at all
         # self._potentials_by_ship = {}
 
         # self.tp = 0
@@ -948,47 +2440,204 @@ class OpponentModel:
         # self.fn = 0
 
     def get_next_positions_for(self, ship):
-        return self._predicted_by_ship[ship]
+        return self._predicted[self._slot_by_id[ship.id]]
 
     def get_next_positions(self):
         positions = set()
-        for ship in self._predicted_by_ship:
-            positions.update(self._predicted_by_ship[ship])
+        for slot in self._slot_by_id.values():
+            positions.update(self._predicted[slot])
         return positions
 
-    def moving_towards(self, ship, pos):
+    def last_move(self, slot):
+        return self._moves[slot][(self._length[slot] - 1) % self._n]
+
+    def context(self, slot):
+        """
+        The last NGRAM_CONTEXT moves the ship in slot made, oldest first, as ALL_DIRECTIONS indices. None if it hasn't
+        been around long enough. Spawning counts as staying still.
+        :param slot:
+        :return:
+        """
+        length = self._length[slot]
+        if length < NGRAM_CONTEXT:
+            return None
+        moves = self._moves[slot]
+        # the moves are kept from the new position to the old one, so they're reversed here
+        return tuple(DIRECTION_INDEX[(-moves[i % self._n][0], -moves[i % self._n][1])]
+                     for i in range(length - NGRAM_CONTEXT, length))
+
+    def record(self, owner, slot, move):
+        """
+        Counts the move the ship in slot just made after its context, and scores last turn's prediction for it.
+        :param owner:
+        :param slot:
+        :param move: the direction it moved in
+        :return:
+        """
+        weights = self._weights[slot]
+        if weights is not None:
+            self.predictions += 1
+            self.correct += move == max(weights, key=weights.get)
+            self.covered += move in weights
+
+        context = self.context(slot)
+        if context is not None:
+            counts = self._counts[owner].get(context)
+            if counts is None:
+                counts = self._counts[owner][context] = [0] * len(constants.ALL_DIRECTIONS)
+            counts[DIRECTION_INDEX[move]] += 1
+
+    def move_probabilities(self, owner, slot):
+        """
+        The likely next moves of the ship in slot from its player's counts, see the class doc.
+        :param owner:
+        :param slot:
+        :return: dict of direction -> probability, or None if the context hasn't been seen enough
+        """
+        context = self.context(slot)
+        counts = None if context is None else self._counts[owner].get(context)
+        if counts is None:
+            return None
+        total = sum(counts)
+        if total < NGRAM_MIN_OBSERVATIONS:
+            return None
+
+        # add one to every count so moves that haven't been seen yet aren't impossible
+        weights = {}
+        for d, count in zip(constants.ALL_DIRECTIONS, counts):
+            p = (count + 1) / (total + len(counts))
+            if p >= NGRAM_MIN_PROBABILITY:
+                weights[d] = p
+        weight_sum = sum(weights.values())
+        return {d: p / weight_sum for d, p in weights.items()}
+
+    def accuracy(self):
+        """
+        :return: the fraction of predictions where the most likely move was made, and where the move was predicted
+        """
+        if self.predictions == 0:
+            return 0, 0
+        return self.correct / self.predictions, self.covered / self.predictions
+
+    def moving_towards(self, slot, pos):
+        """
+        Whether the ship in slot has been getting closer to pos over its last two positions.
+        :param slot:
+        :param pos:
+        :return:
+        """
         last_dist = math.inf
-        for old_pos in self._history_by_ship[ship][-2:]:
-            d = MAP.dist(old_pos, pos)
+        history = self._history[slot]
+        for i in range(max(self._length[slot] - 2, 0), self._length[slot]):
+            d = MAP.dist(history[i % self._n], pos)
             if d > last_dist:
                 return False
             last_dist = d
         return True
 
-    def prob_occupied(self):
-        prob_by_pos = defaultdict(float)
-        for ship, positions in self._predicted_by_ship.items():
-            p = self._pos_by_ship[ship]
-            score_by_pos = {p: 1 for p in positions}
-            if N <= 100:
-                for pos in positions:
-                    if self.moving_towards(ship, pos):
-                        score_by_pos[pos] += 1
-                    if direction_between(p, pos) == self._moves_by_ship[ship][-1]:
-                        score_by_pos[pos] += 1
-            total_score = sum(score_by_pos.values())
-            for pos in positions:
-                prob_by_pos[pos] += score_by_pos[pos] / total_score
+    def occupancy(self, window):
+        """
+        The probability of each position being taken by an opponent ship for each of the next window turns, where turn 0
+        is where the ships are now.
+
+        Turn 1 uses the predicted moves, see expected_next. After that the model has no idea where the ships are going,
+        so each turn is the one before spread evenly over staying still & the cardinal moves.
 
+        :param window:
+        :return: list of window lists of probabilities indexed by y * WIDTH + x
+        """
+        expected = [0.0] * SIZE
+        for slot in self._slot_by_id.values():
+            x, y = self._pos[slot]
+            expected[y * constants.WIDTH + x] += 1
+        layers = [self.capped(expected)]
+
+        expected = self.expected_next()
+        for t in range(1, window):
+            if t > 1:
+                expected = self.spread(expected)
+            layers.append(self.capped(expected))
+        return layers
+
+    @staticmethod
+    def capped(expected):
+        """
+        Turns the expected number of ships at each position into probabilities. Our dropoffs are 0, ships there are
+        free halite!
+        :param expected: list indexed by y * WIDTH + x
+        :return:
+        """
         # TODO do something else for frozen?
-        for pos in prob_by_pos:
-            if prob_by_pos[pos] > 1:
-                prob_by_pos[pos] = 1
+        prob = [1 if p > 1 else p for p in expected]
 
-        for drp in DROPOFFS:
-            prob_by_pos[drp] = 0
+        for x, y in DROPOFFS:
+            prob[y * constants.WIDTH + x] = 0
+
+        return prob
+
+    @staticmethod
+    def spread(expected):
+        """
+        The expected number of ships at each position a turn later, if every ship is equally likely to stay still or
+        make any of the cardinal moves.
+        :param expected: list indexed by y * WIDTH + x
+        :return:
+        """
+        width = constants.WIDTH
+        height = constants.HEIGHT
+        rows = [expected[y * width:(y + 1) * width] for y in range(height)]
+        spread = []
+        for y in range(height):
+            row = rows[y]
+            west = row[-1:] + row[:-1]
+            east = row[1:] + row[:1]
+            spread.extend([(c + n + s + w + e) / 5 for c, n, s, w, e in zip(row, rows[y - 1], rows[(y + 1) % height],
+                                                                             west, east)])
+        return spread
+
+    def expected_next(self):
+        """
+        The expected number of opponent ships at each position next turn.
 
-        return prob_by_pos
+        Each predicted position of a ship scores 1, +1 if the ship is moving towards it (see moving_towards) and +1 if
+        it's in the direction of the ship's last move. This is worked out for all the ships at once, a direction at a
+        time. The newest position in a ship's history is where it is now, so the only position it can be moving away
+        from is the one it came from, which is in the direction of its last move.
+
+        :return: list indexed by y * WIDTH + x
+        """
+        width = constants.WIDTH
+        height = constants.HEIGHT
+        slots = list(self._slot_by_id.values())
+        xs = [self._pos[slot][0] for slot in slots]
+        ys = [self._pos[slot][1] for slot in slots]
+        last_moves = [self.last_move(slot) for slot in slots]
+        stuck = [len(self._predicted[slot]) == 1 for slot in slots]
+
+        directions = constants.ALL_DIRECTIONS
+        indices = []
+        scores = []
+        for d in directions:
+            dx, dy = d
+            indices.append([(y + dy) % height * width + (x + dx) % width for x, y in zip(xs, ys)])
+            # staying still is always towards where the ship is heading
+            towards = [d == (0, 0) or d != m for m in last_moves]
+            heading = [d == m for m in last_moves]
+            scores.append([0 if s and d != (0, 0) else 1 + t + h for s, t, h in zip(stuck, towards, heading)])
+        totals = [sum(ship_scores) for ship_scores in zip(*scores)]
+
+        expected = [0.0] * SIZE
+        for k in range(len(slots)):
+            weights = self._weights[slots[k]]
+            if weights is not None:
+                for j in range(len(directions)):
+                    if directions[j] in weights:
+                        expected[indices[j][k]] += weights[directions[j]]
+                continue
+            for j in range(len(directions)):
+                if scores[j][k] > 0:
+                    expected[indices[j][k]] += scores[j][k] / totals[k]
+        return expected
 
     def update_all(self):
         # predicted = self.get_next_positions()
@@ -1017,41 +2666,57 @@ class OpponentModel:
         # log('Opponent Model: tp={:.2f} tn={:.2f} fp={:.2f} fn={:.2f}'.format(
         #     100 * self.tp / total, 100 * self.tn / total, 100 * self.fp / total, 100 * self.fn / total))
         # log('Opponent Model: mcc={}'.format(mcc))
+        # log('Opponent Model: top move accuracy={:.3f} coverage={:.3f}'.format(*self.accuracy()))
+        if TRACER is not None:
+            TRACER.add(TRACE_OPPONENT_MODEL, self.predictions, self.correct, self.covered)
 
+        live_ids = set()
         for opponent_ship in OTHER_SHIPS:
+            live_ids.add(opponent_ship.id)
             self.update(opponent_ship)
 
-        # TODO make this check in a set, this is slow
-        removed_ships = [ship for ship in self._predicted_by_ship if ship not in OTHER_SHIPS]
-        for ship in removed_ships:
-            del self._pos_by_ship[ship]
-            del self._moves_by_ship[ship]
-            del self._predicted_by_ship[ship]
-            # del self._potentials_by_ship[ship]
-            del self._history_by_ship[ship]
+        # free the slots of the ships that died this turn
+        for ship_id in self._slot_by_id.keys() - live_ids:
+            self._free_slots.append(self._slot_by_id.pop(ship_id))
 
     def update(self, ship):
-        if ship not in self._pos_by_ship:
-            moves = [(0, 0)]
-            history = [ship.pos]
+        slot = self._slot_by_id.get(ship.id)
+        if slot is None:
+            # spawned this turn (or first seen)
+            if len(self._free_slots) > 0:
+                slot = self._free_slots.pop()
+            else:
+                slot = len(self._pos)
+                self._pos.append(None)
+                self._history.append([None] * self._n)
+                self._moves.append([None] * self._n)
+                self._length.append(0)
+                self._predicted.append(None)
+                self._weights.append(None)
+            self._slot_by_id[ship.id] = slot
+            self._weights[slot] = None
+            self._length[slot] = 1
+            self._moves[slot][0] = (0, 0)
+            self._history[slot][0] = ship.pos
         else:
-            moves = self._moves_by_ship[ship]
-            moves.append(direction_between(ship.pos, self._pos_by_ship[ship]))
-            moves = moves[-self._n:]
-            history = self._history_by_ship[ship]
-            history.append(ship.pos)
-            history = history[-self._n:]
+            self.record(ship.owner, slot, direction_between(self._pos[slot], ship.pos))
+            i = self._length[slot] % self._n
+            self._moves[slot][i] = direction_between(ship.pos, self._pos[slot])
+            self._history[slot][i] = ship.pos
+            self._length[slot] += 1
 
-        self._moves_by_ship[ship] = moves
-        self._history_by_ship[ship] = history
-        self._pos_by_ship[ship] = tuple(ship.pos)
+        self._pos[slot] = tuple(ship.pos)
 
+        weights = None
         if ship.halite_amount < floor(MAP[ship.pos].halite_amount / constants.MOVE_COST_RATIO):
             predicted_moves = {(0, 0)}
         else:
-            predicted_moves = list(constants.ALL_DIRECTIONS)
+            if NGRAM_PREDICTION:
+                weights = self.move_probabilities(ship.owner, slot)
+            predicted_moves = list(constants.ALL_DIRECTIONS) if weights is None else list(weights)
+        self._weights[slot] = weights
 
-        self._predicted_by_ship[ship] = set(normalize(add(ship.pos, move)) for move in predicted_moves)
+        self._predicted[slot] = set(normalize(add(ship.pos, move)) for move in predicted_moves)
         # self._potentials_by_ship[ship] = all_neighbors(ship.pos)
 
 
@@ -1060,6 +2725,23 @@ def log(s):
     pass
 
 
+def rss():
+    """
+    The resident set size of this process in bytes. Falls back to the peak RSS where /proc isn't available, and 0
+    where the resource module isn't either (Windows).
+    :return: int
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
 def normalize(p):
     """
     Normalizes a position
@@ -1082,13 +2764,23 @@ def add(a, b):
     return ax + bx, ay + by
 
 
+def flat_index(p):
+    """
+    :param p: tuple
+    :return: the index of p in FLAT_POSITIONS
+    """
+    x, y = p
+    return y % constants.HEIGHT * constants.WIDTH + x % constants.WIDTH
+
+
 def cardinal_neighbors(p):
     """
     Cardinal neighbors of a position
     :param p: tuple
     :return: list[tuple]
     """
-    return [normalize(add(p, d)) for d in constants.CARDINAL_DIRECTIONS]
+    i = 5 * flat_index(p)
+    return [FLAT_POSITIONS[j] for j in NEIGHBORS[i:i + 4]]
 
 
 def all_neighbors(p):
@@ -1097,7 +2789,8 @@ def all_neighbors(p):
     :param p: tuple
     :return: set[tuple]
     """
-    return set(normalize(add(p, d)) for d in constants.ALL_DIRECTIONS)
+    i = 5 * flat_index(p)
+    return set(FLAT_POSITIONS[j] for j in NEIGHBORS[i:i + 5])
 
 
 def direction_between(a, b):
@@ -1107,18 +2800,65 @@ def direction_between(a, b):
     :param b: tuple
     :return: tuple
     """
-    for d in constants.ALL_DIRECTIONS:
-        if normalize(add(a, d)) == normalize(b):
-            return d
+    return DIRECTION_BETWEEN.get((normalize(a), normalize(b)))
+
+
+def bucket_dist_ranges(length, bucket_size):
+    """
+    The closest & farthest distance from every coordinate on an axis to every bucket of bucket_size coordinates on
+    that axis. Memoized, since it only depends on the map size.
+    :param length: int
+    :param bucket_size: int
+    :return: list[list[tuple]], indexed by coordinate and then bucket
+    """
+    key = length, bucket_size
+    if key not in BUCKET_DIST_RANGES:
+        dist_table = MAP.distance_table
+        BUCKET_DIST_RANGES[key] = [
+            [(min(dists), max(dists)) for dists in (
+                [dist_table[c - b] for b in range(b0, min(b0 + bucket_size, length))]
+                for b0 in range(0, length, bucket_size))]
+            for c in range(length)]
+    return BUCKET_DIST_RANGES[key]
+
+
+def plan_group(world, group):
+    """
+    Run in a worker process to plan a group of ships, see PathPlanning.next_positions_for.
+    :param world: see PathPlanning.world
+    :param group: see PathPlanner.group
+    :return: the next position & fallbacks of each of the ships
+    """
+    PathPlanning.load_world(world)
+    planner = PathPlanner.for_group(group)
+    ships = list(range(len(group)))
+    planner.plan(ships)
+    return [(planner.next_positions[i], planner.fallbacks[i]) for i in ships]
+
+
+def attach_snapshot(name):
+    """
+    Run when a worker process starts, attaches to the parent's SNAPSHOT read only.
+    :param name:
+    :return:
+    """
+    global SNAPSHOT
+    SNAPSHOT = GameStateSnapshot(name)
 
 
 def pos_around(p, radius):
     """
-    All of the positions around p within distance `radius`
+    All of the positions around p within distance `radius`. Looked up in KERNELS for the radii the bot uses.
     :param p: tuple
     :param radius: float
-    :return: set[tuple]
+    :return: list[tuple] or set[tuple]
     """
+    kernel = KERNELS.get(radius)
+    if kernel is not None:
+        positions, starts = kernel
+        i = flat_index(p)
+        return [FLAT_POSITIONS[j] for j in positions[starts[i]:starts[i + 1]]]
+
     px, py = p
     positions = set()
     for y in range(radius + 1):
@@ -1143,4 +2883,5 @@ def opponent_halite_next_to(p):
     return halite
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,490 @@
+"""
+Microbenchmarks of the bot's hot paths on made up game states.
+
+    python benchmark.py --sizes 32 64 128 --players 2 4 --phases early mid end --ships 25 100 500 --out bench.json
+
+Each scenario is a game of some map size, number of players, fleet size & phase (how much halite is left, how spread
+out the ships are) written out the way the engine would send it. MyBot reads its globals off of a live game, so each
+scenario is run in its own process with that game as stdin, and the hot paths are timed against the globals that
+builds.
+
+Results are written as JSON so runs on different revisions can be compared, and the latency of each hot path against
+the number of ships & the map size is printed. So are the time to start up (building the static tables), the first
+turn, and loading the static tables once they're cached. So is how often goals_for_ships would hit IncomeEstimation's
+memo cache (see MEMOIZE_HPT), which is most telling on snapshots of real games.
+
+A turn the bot saved as a snapshot (see SNAPSHOT_SLOW_TURNS in MyBot) can be run again instead:
+
+    python benchmark.py --snapshot snapshot-0-312.bin [--profile]
+
+With --solver, goals_for_ships is also run under each ALLOCATION_SOLVER on the same states, and the time it took & the
+summed hpt of the goals it chose are printed side by side.
+"""
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+HOT_PATHS = ['assignments', 'goals_for_ships', 'get_potential_dropoffs', 'a_star', 'next_positions_for',
+             'occupancy']
+STARTUP = ['startup', 'first_turn', 'static_tables_cached']  # timed once per scenario
+PHASES = {
+    # phase: (fraction of the game gone, fraction of the halite left, how far ships are from their shipyard)
+    'early': (0.1, 0.9, 0.15),
+    'mid': (0.5, 0.5, 0.35),
+    'end': (0.95, 0.15, 0.5),
+}
+WARMUP_TURNS = 3  # turns fed to the bot before timing, so the opponent model has some history
+MAX_A_STAR_PATHS = 50  # the number of ships a_star is timed planning for
+PROFILE_LINES = 40  # the number of functions printed when profiling a snapshot
+SOLVERS = ['greedy', 'auction']  # the ALLOCATION_SOLVERs compared with --solver
+
+CONSTANTS = {
+    'NEW_ENTITY_ENERGY_COST': 1000, 'DROPOFF_COST': 4000, 'MAX_ENERGY': 1000, 'EXTRACT_RATIO': 4,
+    'MOVE_COST_RATIO': 10, 'INSPIRATION_ENABLED': True, 'INSPIRATION_RADIUS': 4, 'INSPIRATION_SHIP_COUNT': 2,
+    'INSPIRED_EXTRACT_RATIO': 4, 'INSPIRED_BONUS_MULTIPLIER': 2.0, 'INSPIRED_MOVE_COST_RATIO': 10,
+    'CAPTURE_ENABLED': False, 'CAPTURE_RADIUS': 3, 'SHIPS_ABOVE_FOR_CAPTURE': 3,
+}
+
+
+def max_turns(size):
+    return 400 + 25 * (size - 32) // 8
+
+
+def shipyards(size, players):
+    """
+    Each player's shipyard, the same place in each copy of the tile generate_halite repeats.
+    :param size: the width & height of the map
+    :param players: 2 or 4
+    :return: list of (x, y)
+    """
+    quarter, half = size // 4, size // 2
+    if players == 2:
+        return [(quarter, half), (quarter + half, half)]
+    return [(quarter, quarter), (quarter + half, quarter), (quarter, quarter + half), (quarter + half, quarter + half)]
+
+
+def generate_halite(size, players, rng):
+    """
+    Halite in blobs like a real map. The blobs are made on a tile, half the map wide (and half high with 4 players),
+    which is repeated to fill the map. The map wraps around, so every player sees exactly the same map, the same way
+    up, from their shipyard: a mirrored map would turn one player's east into another's west, and bots that break ties
+    by direction would play differently from each seat.
+    :param size: the width & height of the map
+    :param players: 2 or 4
+    :param rng: random.Random
+    :return: the halite on the map as a list of rows
+    """
+    width = size // 2
+    height = size if players == 2 else size // 2
+    tile = [[0] * width for _ in range(height)]
+    for _ in range(width * height // 12):
+        cx, cy = rng.randrange(width), rng.randrange(height)
+        amount = rng.randint(100, 1000)
+        radius = rng.randint(1, 4)
+        for dy in range(-radius, radius + 1):
+            for dx in range(-radius, radius + 1):
+                d = abs(dx) + abs(dy)
+                if d <= radius:
+                    x, y = (cx + dx) % width, (cy + dy) % height
+                    tile[y][x] = min(1000, tile[y][x] + amount // (d + 1))
+    for row in tile:
+        for x in range(width):
+            row[x] += rng.randint(0, 30)
+    return [[tile[y % height][x % width] for x in range(size)] for y in range(size)]
+
+
+def generate(size, players, phase, ships, seed=0):
+    """
+    A made up game as the engine would send it to player 0: the start of the game, then WARMUP_TURNS turns.
+
+    Halite is in blobs like a real map (see generate_halite), and mined down towards the shipyards later in the game.
+    Each player has the given number of ships spread around their shipyard, & dropoffs later on.
+
+    :param size: the width & height of the map
+    :param players: 2 or 4
+    :param phase: a key of PHASES
+    :param ships: the number of ships each player has
+    :param seed:
+    :return: the text of the game
+    """
+    rng = random.Random(seed)
+    gone, halite_left, spread = PHASES[phase]
+    yards = shipyards(size, players)
+
+    grid = generate_halite(size, players, rng)
+    for y in range(size):
+        for x in range(size):
+            # closer to a shipyard is mined out more
+            d = min(abs(x - yx) + abs(y - yy) for yx, yy in yards) / size
+            grid[y][x] = int(grid[y][x] * min(1, halite_left * (0.5 + d)))
+    for x, y in yards:
+        grid[y][x] = 0
+
+    occupied = set(yards)
+
+    def near(pos, radius):
+        while True:
+            x = (pos[0] + rng.randint(-radius, radius)) % size
+            y = (pos[1] + rng.randint(-radius, radius)) % size
+            if (x, y) not in occupied:
+                occupied.add((x, y))
+                return x, y
+
+    next_id = 0
+    fleets = []
+    dropoffs = []
+    for yard in yards:
+        player_dropoffs = []
+        for _ in range({'early': 0, 'mid': 1, 'end': 2}[phase]):
+            player_dropoffs.append((next_id, near(yard, size // 4)))
+            next_id += 1
+        dropoffs.append(player_dropoffs)
+        fleet = []
+        for _ in range(ships):
+            fleet.append([next_id, near(yard, max(int(size * spread), 1)), rng.randint(0, int(1000 * gone))])
+            next_id += 1
+        fleets.append(fleet)
+
+    lines = [json.dumps(dict(CONSTANTS, MAX_TURNS=max_turns(size))), '{} 0'.format(players)]
+    lines.extend('{} {} {}'.format(player, *yard) for player, yard in enumerate(yards))
+    lines.append('{} {}'.format(size, size))
+    lines.extend(' '.join(map(str, row)) for row in grid)
+
+    last_turn = max(int(max_turns(size) * gone), WARMUP_TURNS)
+    for turn in range(last_turn - WARMUP_TURNS + 1, last_turn + 1):
+        lines.append(str(turn))
+        for player in range(players):
+            lines.append('{} {} {} {}'.format(player, ships, len(dropoffs[player]), 5000 + rng.randint(0, 20000)))
+            for ship in fleets[player]:
+                lines.append('{} {} {} {}'.format(ship[0], ship[1][0], ship[1][1], ship[2]))
+            for dropoff_id, (x, y) in dropoffs[player]:
+                lines.append('{} {} {}'.format(dropoff_id, x, y))
+        lines.append('0')
+
+        # move the ships around a bit for the next turn
+        for fleet in fleets:
+            for ship in fleet:
+                dx, dy = rng.choice([(1, 0), (0, 1), (-1, 0), (0, -1), (0, 0)])
+                moved = ((ship[1][0] + dx) % size, (ship[1][1] + dy) % size)
+                if moved not in occupied:
+                    occupied.remove(ship[1])
+                    occupied.add(moved)
+                    ship[1] = moved
+
+    return '\n'.join(lines) + '\n'
+
+
+def timed(fn, repeat):
+    """
+    :param fn:
+    :param repeat: the number of times to run fn
+    :return: dict of the median & min time in ms, and the number of runs
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(1000 * (time.perf_counter() - start))
+    return {'median_ms': median(times), 'min_ms': min(times), 'runs': repeat}
+
+
+def time_hot_paths(commander, repeat, solvers=False):
+    """
+    Times each of the hot paths against the bot's globals as they are now.
+    :param commander: a Commander that has run update_globals for the turn
+    :param repeat:
+    :param solvers: whether to compare the ALLOCATION_SOLVERs as well, see compare_solvers
+    :return: dict of hot path -> timings
+    """
+    import MyBot
+    from MyBot import ResourceAllocation, PathPlanning, ReservationTable
+
+    model = commander.opponent_model
+    opponent_next_positions = model.get_next_positions()
+    goals, mining_times, _, _, allocation = ResourceAllocation.goals_for_ships(opponent_next_positions, {})
+    # the goals before any ships were sent to make dropoffs, which is what get_potential_dropoffs is given
+    mining_goals = [allocation[ship.id][1] if ship.id in allocation else goals[i]
+                    for i, ship in enumerate(MyBot.SHIPS)]
+    paths = [(ship.pos, goal, ship.halite_amount) for ship, goal in zip(MyBot.SHIPS, goals)
+             if goal is not None and goal != ship.pos][:MAX_A_STAR_PATHS]
+
+    def a_star():
+        for start, goal, halite in paths:
+            PathPlanning.a_star(start, goal, halite, ReservationTable())
+
+    results = {
+        'assignments': timed(lambda: ResourceAllocation.assignments(set(range(MyBot.N))), repeat),
+        'goals_for_ships': timed(lambda: ResourceAllocation.goals_for_ships(opponent_next_positions, {}), repeat),
+        'get_potential_dropoffs': timed(lambda: ResourceAllocation.get_potential_dropoffs(mining_goals), repeat),
+        'a_star': timed(a_star, repeat),
+        'next_positions_for': timed(
+            lambda: PathPlanning.next_positions_for(model, list(goals), mining_times, False), repeat),
+        'occupancy': timed(lambda: model.occupancy(MyBot.PLANNING_WINDOW), repeat),
+    }
+    results['a_star']['paths'] = len(paths)
+    results['hpt_cache'] = hpt_cache_info(opponent_next_positions)
+    if solvers:
+        results['solvers'] = compare_solvers(opponent_next_positions, repeat)
+    return results
+
+
+def compare_solvers(opponent_next_positions, repeat):
+    """
+    Runs goals_for_ships under each of SOLVERS. The goals are scored the way ResourceAllocation.assignments scores a
+    position, before any ships are sent to make dropoffs.
+    :param opponent_next_positions:
+    :param repeat:
+    :return: dict of solver -> its timings & the summed hpt of the goals it chose
+    """
+    import MyBot
+    from MyBot import IncomeEstimation, ResourceAllocation
+
+    def hpt_of(ship, pos):
+        halite_on_ground = MyBot.MAP[pos].halite_amount
+        distance = MyBot.MAP.dist(ship.pos, pos) + MyBot.DIFFICULTY[pos]
+        hpt, _, _ = IncomeEstimation.hpt_of(MyBot.TURNS_REMAINING, distance, MyBot.DROPOFF_DIST_BY_POS[pos],
+                                            ship.halite_amount, ship.space_left, halite_on_ground,
+                                            halite_on_ground * MyBot.BONUS_MULTIPLIER_BY_POS[pos])
+        return hpt
+
+    results = {}
+    default = MyBot.ALLOCATION_SOLVER
+    for solver in SOLVERS:
+        MyBot.ALLOCATION_SOLVER = solver
+        results[solver] = timed(lambda: ResourceAllocation.goals_for_ships(opponent_next_positions, {}), repeat)
+        allocation = ResourceAllocation.goals_for_ships(opponent_next_positions, {})[4]
+        results[solver]['hpt'] = sum(hpt_of(ship, allocation[ship.id][1]) for ship in MyBot.SHIPS
+                                     if ship.id in allocation and allocation[ship.id][1] is not None)
+    MyBot.ALLOCATION_SOLVER = default
+    return results
+
+
+def hpt_cache_info(opponent_next_positions):
+    """
+    Runs goals_for_ships once with IncomeEstimation.hpt_of memoized, starting from an empty cache like a turn does.
+    :param opponent_next_positions:
+    :return: dict of the cache's hits, misses & hit rate
+    """
+    import MyBot
+
+    MyBot.IncomeEstimation.memoize(True)
+    MyBot.ResourceAllocation.goals_for_ships(opponent_next_positions, {})
+    info = MyBot.IncomeEstimation.hpt_of.cache_info()
+    MyBot.IncomeEstimation.memoize(MyBot.MEMOIZE_HPT)
+    calls = info.hits + info.misses
+    return {'hits': info.hits, 'misses': info.misses, 'hit_rate': info.hits / calls if calls else 0}
+
+
+def run_scenario(scenario, repeat, trace=False, solvers=False):
+    """
+    Runs in a process of its own. Imports the bot with the scenario's game as stdin and times each of the hot paths.
+    :param scenario: dict of generate's arguments
+    :param repeat:
+    :param trace: whether to time the bot with TRACE on
+    :param solvers: whether to compare the ALLOCATION_SOLVERs as well
+    :return: dict of hot path -> timings
+    """
+    sys.stdin = io.StringIO(generate(**scenario))
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        import MyBot
+        MyBot.STATIC_TABLES_DIR = None  # startup is timed building the static tables
+        MyBot.TRACE = trace
+        commander = MyBot.Commander()
+        startup = 1000 * (time.perf_counter() - start)
+        for turn in range(WARMUP_TURNS):
+            MyBot.GAME.update_frame()
+            start = time.perf_counter()
+            commander.update_globals()
+            if turn == 0:
+                commander.produce_commands()
+                first_turn = 1000 * (time.perf_counter() - start)
+
+    results = time_hot_paths(commander, repeat, solvers)
+    results['startup'] = {'median_ms': startup, 'min_ms': startup, 'runs': 1}
+    results['first_turn'] = {'median_ms': first_turn, 'min_ms': first_turn, 'runs': 1}
+    with tempfile.TemporaryDirectory() as cache:
+        MyBot.STATIC_TABLES_DIR = cache
+        # tables already loaded in this process are shared rather than loaded again, so forget them each time
+        MyBot.STATIC_TABLES.clear()
+        MyBot.StaticTables.load()
+        assert os.path.exists(os.path.join(cache, MyBot.StaticTables.name())), 'static tables weren\'t cached'
+
+        def load_cached():
+            MyBot.STATIC_TABLES.clear()
+            assert MyBot.StaticTables.load(), 'static tables weren\'t loaded from the cache'
+
+        results['static_tables_cached'] = timed(load_cached, repeat)
+    return results
+
+
+def run_snapshot(path, repeat, profile, trace=False, solvers=False):
+    """
+    Runs the turn saved in a snapshot (see MyBot.TurnSnapshot) again, either timing each of the hot paths or profiling
+    the whole turn. Needs a process of its own, like run_scenario.
+    :param path: a snapshot file the bot saved
+    :param repeat:
+    :param profile: whether to print a profile of the turn instead of timing the hot paths
+    :param trace: whether to run the bot with TRACE on
+    :param solvers: whether to compare the ALLOCATION_SOLVERs as well
+    :return: dict of hot path -> timings, or None when profiling
+    """
+    from hlt import snapshot
+
+    sections = snapshot.load(path)
+    sys.stdin = io.StringIO(snapshot.engine_input(sections))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import MyBot
+        MyBot.TRACE = trace
+        commander = MyBot.Commander()
+        MyBot.GAME.update_frame()
+        MyBot.TurnSnapshot.restore(commander, sections)
+
+        if profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            commander.update_globals()
+            commander.produce_commands()
+            profiler.disable()
+        else:
+            commander.update_globals()
+
+    if profile:
+        pstats.Stats(profiler, stream=sys.__stdout__).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return None
+    return time_hot_paths(commander, repeat, solvers)
+
+
+def print_curves(results):
+    """
+    Prints a table for each hot path & kind of game: ships down the side, map size across the top.
+    :param results:
+    :return:
+    """
+    kinds = sorted(set((r['scenario']['players'], r['scenario']['phase']) for r in results))
+    sizes = sorted(set(r['scenario']['size'] for r in results))
+    ships = sorted(set(r['scenario']['ships'] for r in results))
+    for hot_path in HOT_PATHS + STARTUP:
+        for players, phase in kinds:
+            by_key = {(r['scenario']['ships'], r['scenario']['size']): r['timings'][hot_path]['median_ms']
+                      for r in results if r['scenario']['players'] == players and r['scenario']['phase'] == phase}
+            print('{} ({}p {}) median ms'.format(hot_path, players, phase))
+            print('{:>8}'.format('ships') + ''.join('{:>10}'.format('{0}x{0}'.format(size)) for size in sizes))
+            for n in ships:
+                cells = [by_key.get((n, size)) for size in sizes]
+                print('{:>8}'.format(n) + ''.join('{:>10}'.format('-' if c is None else '{:.1f}'.format(c))
+                                                    for c in cells))
+            print()
+    for players, phase in kinds:
+        by_key = {(r['scenario']['ships'], r['scenario']['size']): r['timings']['hpt_cache']['hit_rate']
+                  for r in results if r['scenario']['players'] == players and r['scenario']['phase'] == phase}
+        print('hpt_cache ({}p {}) hit rate'.format(players, phase))
+        print('{:>8}'.format('ships') + ''.join('{:>10}'.format('{0}x{0}'.format(size)) for size in sizes))
+        for n in ships:
+            cells = [by_key.get((n, size)) for size in sizes]
+            print('{:>8}'.format(n) + ''.join('{:>10}'.format('-' if c is None else '{:.1%}'.format(c))
+                                                for c in cells))
+        print()
+
+
+def print_solvers(results):
+    """
+    Prints a row for each scenario: the median time & summed hpt of goals_for_ships under each of SOLVERS.
+    :param results: with the solvers compared
+    :return:
+    """
+    names = [' '.join('{}={}'.format(key, value) for key, value in r['scenario'].items() if key != 'seed')
+             for r in results]
+    width = max(len(name) for name in names + ['goals_for_ships']) + 2
+    print('{:<{}}'.format('goals_for_ships', width) +
+          ''.join('{:>12}{:>12}'.format(solver + ' ms', solver + ' hpt') for solver in SOLVERS))
+    for name, r in zip(names, results):
+        solvers = r['timings']['solvers']
+        print('{:<{}}'.format(name, width) + ''.join('{:>12.1f}{:>12.1f}'.format(solvers[solver]['median_ms'],
+                                                                                 solvers[solver]['hpt'])
+                                                       for solver in SOLVERS))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 64, 128])
+    parser.add_argument('--players', type=int, nargs='+', default=[2])
+    parser.add_argument('--phases', nargs='+', default=['mid'], choices=sorted(PHASES))
+    parser.add_argument('--ships', type=int, nargs='+', default=[25, 100, 250, 500])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--snapshot', help='time the hot paths on a turn the bot saved, instead of made up games')
+    parser.add_argument('--profile', action='store_true', help='with --snapshot, profile the whole turn')
+    parser.add_argument('--traces', action='store_true', help='time the bot with TRACE on, see hlt/trace.py')
+    parser.add_argument('--solver', action='store_true', help='compare goals_for_ships under each ALLOCATION_SOLVER')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario is not None:
+        # running one scenario for the parent process
+        results = run_scenario(json.loads(args.scenario), args.repeat, args.traces, args.solver)
+        sys.__stdout__.write(json.dumps(results) + '\n')
+        return
+
+    if args.snapshot is not None:
+        path = os.path.abspath(args.snapshot)
+        with tempfile.TemporaryDirectory() as cwd:
+            os.chdir(cwd)
+            results = run_snapshot(path, args.repeat, args.profile, args.traces, args.solver)
+        if results is not None:
+            for hot_path in HOT_PATHS:
+                print('{:>24} {:>10.1f} ms'.format(hot_path, results[hot_path]['median_ms']))
+            hpt_cache = results['hpt_cache']
+            print('{:>24} {:>10.1%} ({} hits, {} misses)'.format(
+                'hpt_cache', hpt_cache['hit_rate'], hpt_cache['hits'], hpt_cache['misses']))
+            if args.solver:
+                print()
+                print_solvers([{'scenario': {'snapshot': os.path.basename(path)}, 'timings': results}])
+        return
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=root)
+    results = []
+    with tempfile.TemporaryDirectory() as cwd:  # the bot writes its log to the working directory
+        for size in args.sizes:
+            for players in args.players:
+                for phase in args.phases:
+                    for ships in args.ships:
+                        if players * ships > size * size // 4:
+                            continue
+                        scenario = {'size': size, 'players': players, 'phase': phase, 'ships': ships,
+                                    'seed': args.seed}
+                        print('running {}'.format(scenario), file=sys.stderr)
+                        flags = [flag for flag, on in (('--traces', args.traces), ('--solver', args.solver)) if on]
+                        output = subprocess.check_output(
+                            [sys.executable, os.path.abspath(__file__), '--scenario', json.dumps(scenario),
+                             '--repeat', str(args.repeat)] + flags, cwd=cwd, env=env)
+                        results.append({'scenario': scenario, 'timings': json.loads(output.decode())})
+
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                           stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    with open(args.out, 'w') as f:
+        json.dump({'revision': revision, 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+
+    print_curves(results)
+    if args.solver:
+        print_solvers(results)
+
+
+if __name__ == '__main__':
+    main()
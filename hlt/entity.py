@@ -16,13 +16,15 @@ class Entity(abc.ABC):
         self.pos = position.x, position.y
 
     @staticmethod
-    def _generate(player_id):
+    def _generate(player_id, ship_id, x_position, y_position):
         """
         Method which creates an entity for a specific player given input from the engine.
         :param player_id: The player id for the player who owns this entity
+        :param ship_id: The entity's id
+        :param x_position:
+        :param y_position:
         :return: An instance of Entity along with its id
         """
-        ship_id, x_position, y_position = map(int, input().split())
         return ship_id, Entity(player_id, ship_id, Position(x_position, y_position))
 
     def __repr__(self):
@@ -90,13 +92,16 @@ class Ship(Entity):
         return "{} {} {}".format(commands.MOVE, self.id, commands.STAY_STILL)
 
     @staticmethod
-    def _generate(player_id):
+    def _generate(player_id, ship_id, x_position, y_position, halite):
         """
         Creates an instance of a ship for a given player given the engine's input.
         :param player_id: The id of the player who owns this ship
+        :param ship_id: The ship's id
+        :param x_position:
+        :param y_position:
+        :param halite: The halite the ship is carrying
         :return: The ship id and ship object
         """
-        ship_id, x_position, y_position, halite = map(int, input().split())
         return ship_id, Ship(player_id, ship_id, Position(x_position, y_position), halite)
 
     def __repr__(self):
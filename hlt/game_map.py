@@ -1,3 +1,4 @@
+import heapq
 import queue
 
 from . import constants
@@ -59,25 +60,28 @@ class Player:
         return ship_id in self._ships
 
     @staticmethod
-    def _generate():
+    def _generate(player, shipyard_x, shipyard_y):
         """
         Creates a player object from the input given by the game engine
+        :param player: The player's id
+        :param shipyard_x: The x coordinate of the player's shipyard
+        :param shipyard_y: The y coordinate of the player's shipyard
         :return: The player object
         """
-        player, shipyard_x, shipyard_y = map(int, input().split())
         return Player(player, Shipyard(player, -1, Position(shipyard_x, shipyard_y, normalize=False)))
 
-    def _update(self, num_ships, num_dropoffs, halite):
+    def _update(self, halite, ships, dropoffs):
         """
         Updates this player object considering the input from the game engine for the current specific turn.
-        :param num_ships: The number of ships this player has this turn
-        :param num_dropoffs: The number of dropoffs this player has this turn
         :param halite: How much halite the player has in total
+        :param ships: (id, x, y, halite) of each of the player's ships this turn
+        :param dropoffs: (id, x, y) of each of the player's dropoffs this turn
         :return: nothing.
         """
         self.halite_amount = halite
-        self._ships = {id: ship for (id, ship) in [Ship._generate(self.id) for _ in range(num_ships)]}
-        self._dropoffs = {id: dropoff for (id, dropoff) in [Dropoff._generate(self.id) for _ in range(num_dropoffs)]}
+        self._ships = {id: ship for (id, ship) in [Ship._generate(self.id, *ship) for ship in ships]}
+        self._dropoffs = {id: dropoff for (id, dropoff) in [Dropoff._generate(self.id, *dropoff)
+                                                            for dropoff in dropoffs]}
         for id in self._ships:
             self.ships_produced.add(id)
 
@@ -158,6 +162,10 @@ class GameMap:
         self.distance_table.extend(reversed(self.distance_table[1:-1]))
         self.distance_table.extend(reversed(self.distance_table[1:-1]))
 
+        # the halite each changed cell had before the last update, keyed by position
+        self.changed_halite = {}
+        self._rebuild_halite_heap()
+
     def __getitem__(self, location):
         """
         Getter for position object or entity objects within the game map
@@ -169,6 +177,33 @@ class GameMap:
     def halite_at(self, position):
         return self._cells[position].halite_amount
 
+    def largest_halite_positions(self, n):
+        """
+        The n positions with the most halite on them, largest first. Ties are broken by position.
+
+        Backed by a heap of (-halite, position) entries that only gets pushed to when a cell changes. Entries that no
+        longer match the cell's halite are lazily thrown away when they are popped.
+        :param n: The number of positions to return
+        :return: list of positions
+        """
+        heap = self._halite_heap
+        largest = []
+        seen = set()
+        while len(heap) > 0 and len(largest) < n:
+            entry = heapq.heappop(heap)
+            neg_halite, pos = entry
+            if pos in seen or self._cells[pos].halite_amount != -neg_halite:
+                continue
+            seen.add(pos)
+            largest.append(entry)
+        for entry in largest:
+            heapq.heappush(heap, entry)
+        return [pos for _, pos in largest]
+
+    def _rebuild_halite_heap(self):
+        self._halite_heap = [(-cell.halite_amount, pos) for pos, cell in self._cells.items()]
+        heapq.heapify(self._halite_heap)
+
     def calculate_distance(self, source, target):
         """
         Compute the Manhattan distance between two locations.
@@ -253,23 +288,26 @@ class GameMap:
         return Direction.Still
 
     @staticmethod
-    def _generate():
+    def _generate(map_width, map_height, halite):
         """
         Creates a map object from the input given by the game engine
+        :param map_width: The width of the map
+        :param map_height: The height of the map
+        :param halite: The halite on each cell, as a list of rows
         :return: The map object
         """
-        map_width, map_height = map(int, input().split())
         game_map = {}
         for y_position in range(map_height):
-            cells = input().split()
+            cells = halite[y_position]
             for x_position in range(map_width):
                 game_map[(x_position, y_position)] = MapCell(Position(x_position, y_position, normalize=False),
-                                                             int(cells[x_position]))
+                                                             cells[x_position])
         return GameMap(game_map, map_width, map_height)
 
-    def _update(self):
+    def _update(self, cells):
         """
         Updates this map object from the input given by the game engine
+        :param cells: (x, y, halite) of each cell that changed this turn
         :return: nothing
         """
         # Mark cells as safe for navigation (will re-mark unsafe cells
@@ -278,6 +316,15 @@ class GameMap:
             for x in range(self.width):
                 self._cells[(x, y)].ship = None
 
-        for _ in range(int(input())):
-            cell_x, cell_y, cell_energy = map(int, input().split())
-            self._cells[(cell_x, cell_y)].halite_amount = cell_energy
+        self.changed_halite = {}
+        for cell_x, cell_y, cell_energy in cells:
+            pos = (cell_x, cell_y)
+            cell = self._cells[pos]
+            if cell.halite_amount != cell_energy:
+                self.changed_halite.setdefault(pos, cell.halite_amount)
+                cell.halite_amount = cell_energy
+                heapq.heappush(self._halite_heap, (-cell_energy, pos))
+
+        # out of date entries pile up in the heap, so every so often throw them all away
+        if len(self._halite_heap) > 2 * len(self._cells):
+            self._rebuild_halite_heap()
@@ -1,26 +1,38 @@
 import json
 import logging
 import sys
+from collections import namedtuple
 
 from . import constants
 from .game_map import GameMap, Player
 
+# The start of the game: the constants JSON, the number of players, our player id, (player id, x, y) of each
+# shipyard, the map's width & height, and the halite on the map as a list of rows
+GameStart = namedtuple('GameStart', ['constants', 'num_players', 'my_id', 'shipyards', 'width', 'height', 'halite'])
+
+# A turn: the turn number, (player id, halite, ships, dropoffs) for each player where ships are (id, x, y, halite) &
+# dropoffs are (id, x, y), and (x, y, halite) of each cell that changed
+Frame = namedtuple('Frame', ['turn', 'players', 'cells'])
+
+
 class Game:
     """
     The game object holds all metadata pertinent to the game and all its contents
     """
-    def __init__(self):
+    def __init__(self, start=None):
         """
         Initiates a game object collecting all start-state instances for the contained items for pre-game.
         Also sets up basic logging.
+        :param start: The GameStart, read from the engine if not given.
         """
+        if start is None:
+            start = read_start()
         self.turn_number = 0
 
-        # Grab constants JSON
-        raw_constants = input()
-        constants.load_constants(json.loads(raw_constants))
+        self.raw_constants = start.constants
+        constants.load_constants(self.raw_constants)
 
-        num_players, self.my_id = map(int, input().split())
+        self.my_id = start.my_id
 
         logging.basicConfig(
             filename="bot-{}.log".format(self.my_id),
@@ -29,12 +41,12 @@ class Game:
         )
 
         self.players = {}
-        for player in range(num_players):
-            self.players[player] = Player._generate()
+        for player, shipyard in enumerate(start.shipyards):
+            self.players[player] = Player._generate(*shipyard)
         self.me = self.players[self.my_id]
         self.others = list(self.players)
         self.others.remove(self.my_id)
-        self.game_map = GameMap._generate()
+        self.game_map = GameMap._generate(start.width, start.height, start.halite)
         constants.set_dimensions(self.game_map.width, self.game_map.height)
         constants.set_num_opponents(len(self.others))
 
@@ -45,19 +57,21 @@ class Game:
         """
         send_commands([name])
 
-    def update_frame(self):
+    def update_frame(self, frame=None):
         """
         Updates the game object's state.
+        :param frame: The turn's Frame, read from the engine if not given.
         :returns: nothing.
         """
-        self.turn_number = int(input())
+        if frame is None:
+            frame = read_frame(len(self.players))
+        self.turn_number = frame.turn
         # logging.info("=============== TURN {:03} ================".format(self.turn_number))
 
-        for _ in range(len(self.players)):
-            player, num_ships, num_dropoffs, halite = map(int, input().split())
-            self.players[player]._update(num_ships, num_dropoffs, halite)
+        for player, halite, ships, dropoffs in frame.players:
+            self.players[player]._update(halite, ships, dropoffs)
 
-        self.game_map._update()
+        self.game_map._update(frame.cells)
 
         # Mark cells with ships as unsafe for navigation
         for player in self.players.values():
@@ -78,6 +92,36 @@ class Game:
         send_commands(commands)
 
 
+def read_start():
+    """
+    Reads the start of the game from the engine.
+    :return: GameStart
+    """
+    raw_constants = json.loads(input())
+    num_players, my_id = map(int, input().split())
+    shipyards = [tuple(map(int, input().split())) for _ in range(num_players)]
+    width, height = map(int, input().split())
+    halite = [list(map(int, input().split())) for _ in range(height)]
+    return GameStart(raw_constants, num_players, my_id, shipyards, width, height, halite)
+
+
+def read_frame(num_players):
+    """
+    Reads a turn from the engine.
+    :param num_players: The number of players in the game.
+    :return: Frame
+    """
+    turn = int(input())
+    players = []
+    for _ in range(num_players):
+        player, num_ships, num_dropoffs, halite = map(int, input().split())
+        ships = [tuple(map(int, input().split())) for _ in range(num_ships)]
+        dropoffs = [tuple(map(int, input().split())) for _ in range(num_dropoffs)]
+        players.append((player, halite, ships, dropoffs))
+    cells = [tuple(map(int, input().split())) for _ in range(int(input()))]
+    return Frame(turn, players, cells)
+
+
 def send_commands(commands):
     """
     Sends a list of commands to the engine.
@@ -86,3 +130,13 @@ def send_commands(commands):
     """
     print(" ".join(commands))
     sys.stdout.flush()
+
+
+def send_encoded(data):
+    """
+    Sends commands that are already encoded, e.g. b"g m 1 n\\n", to the engine in a single write.
+    :param data: The bytes of the commands, ending in a newline.
+    :return: nothing.
+    """
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
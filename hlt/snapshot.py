@@ -0,0 +1,127 @@
+"""
+A compact binary format for the state of the game at the start of a turn, so slow turns can be looked at on their own.
+
+A snapshot is a set of named sections. Each is a flat array of one type (an array module type code), except 'meta'
+which is UTF-8 JSON. Layout, in native byte order:
+
+    magic (8 bytes), number of sections (u32)
+    then for each section:
+        length of name (u8), name, type code (1 byte), number of items (u32), padding up to a multiple of 8
+        the items
+
+Loading is a single read (or a memory map), and every section is a memoryview into that buffer, cast to its type.
+"""
+
+import json
+import mmap
+import struct
+from array import array
+
+MAGIC = b'HLTSNAP1'
+ALIGNMENT = 8
+
+
+def dumps(sections):
+    """
+    :param sections: dict of name -> array, or 'meta' -> anything JSON serializable
+    :return: bytes
+    """
+    chunks = [MAGIC, struct.pack('=I', len(sections))]
+    size = len(MAGIC) + 4
+    for name, values in sections.items():
+        if name == 'meta':
+            values = array('B', json.dumps(values).encode())
+        header = struct.pack('=B', len(name)) + name.encode() + values.typecode.encode() + struct.pack(
+            '=I', len(values))
+        header += b'\0' * (-(size + len(header)) % ALIGNMENT)
+        data = values.tobytes()
+        chunks.extend([header, data])
+        size += len(header) + len(data)
+    return b''.join(chunks)
+
+
+def loads(data):
+    """
+    :param data: bytes from dumps
+    :return: dict of name -> memoryview of the section's items, 'meta' -> the decoded JSON
+    :raises ValueError: if data isn't a whole snapshot (struct.error if it ends inside a section's header)
+    """
+    view = memoryview(data)
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError('not a snapshot')
+    offset = len(MAGIC)
+    count, = struct.unpack_from('=I', view, offset)
+    offset += 4
+
+    sections = {}
+    for _ in range(count):
+        name_length, = struct.unpack_from('=B', view, offset)
+        name = bytes(view[offset + 1:offset + 1 + name_length]).decode()
+        offset += 1 + name_length
+        if offset + 5 > len(view):
+            raise ValueError('snapshot is truncated')
+        typecode = chr(view[offset])
+        items, = struct.unpack_from('=I', view, offset + 1)
+        offset += 5
+        offset += -offset % ALIGNMENT
+        nbytes = items * array(typecode).itemsize
+        if offset + nbytes > len(view):
+            raise ValueError('snapshot is truncated')
+        sections[name] = view[offset:offset + nbytes].cast(typecode)
+        offset += nbytes
+
+    sections['meta'] = json.loads(bytes(sections['meta']).decode())
+    return sections
+
+
+def save(path, sections):
+    with open(path, 'wb') as f:
+        f.write(dumps(sections))
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def load_mapped(path):
+    """
+    Like load, but the file is memory mapped instead of read, so only the parts that are used are paged in.
+    :param path:
+    :return: see loads
+    """
+    with open(path, 'rb') as f:
+        return loads(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def engine_input(sections):
+    """
+    The start of the game and the snapshot's turn, as the engine would send them to the bot. Reading this with
+    hlt.Game() & Game.update_frame() recreates the players, ships, dropoffs & map of the snapshot.
+
+    Uses the 'meta', 'halite', 'ships' (owner, id, x, y, halite) and 'dropoffs' (owner, id, x, y) sections.
+
+    :param sections: dict from loads
+    :return: str
+    """
+    meta = sections['meta']
+    width = meta['width']
+    players = meta['players']
+    halite = sections['halite']
+    ships = sections['ships']
+    dropoffs = sections['dropoffs']
+
+    lines = [json.dumps(meta['constants']), '{} {}'.format(len(players), meta['my_id'])]
+    lines.extend('{} {} {}'.format(player['id'], *player['shipyard']) for player in players)
+    lines.append('{} {}'.format(width, meta['height']))
+    lines.extend(' '.join(map(str, halite[y * width:(y + 1) * width])) for y in range(meta['height']))
+
+    lines.append(str(meta['turn']))
+    for player in players:
+        player_ships = [ships[i:i + 5] for i in range(0, len(ships), 5) if ships[i] == player['id']]
+        player_dropoffs = [dropoffs[i:i + 4] for i in range(0, len(dropoffs), 4) if dropoffs[i] == player['id']]
+        lines.append('{} {} {} {}'.format(player['id'], len(player_ships), len(player_dropoffs), player['halite']))
+        lines.extend('{} {} {} {}'.format(*ship[1:]) for ship in player_ships)
+        lines.extend('{} {} {}'.format(*dropoff[1:]) for dropoff in player_dropoffs)
+    lines.append('0')
+    return '\n'.join(lines) + '\n'
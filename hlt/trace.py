@@ -0,0 +1,109 @@
+"""
+Structured trace events that are cheap enough to leave on during a game.
+
+Recording an event packs its type, the turn & its fields into a buffer allocated up front, with no formatting or
+writing. The buffer is drained to the trace file in one write after the turn's commands are sent, while the bot would
+be waiting on the engine anyway. If a turn records more events than the buffer holds, the rest are counted as dropped
+rather than growing it.
+
+The file starts with a header describing the events, so it can be read back on its own:
+
+    magic (8 bytes), length of header (u32), header (UTF-8 JSON: list of [event name, field names])
+    then records of: event type (u32), turn (i32), fields (f64 each, as many as the event with the most fields)
+
+    python -m hlt.trace trace-20261019-120000-000000-0.bin > trace.jsonl
+"""
+
+import json
+import logging
+import struct
+import sys
+
+MAGIC = b'HLTTRACE'
+
+
+def record_format(events):
+    """
+    :param events: list of (event name, field names)
+    :return: struct.Struct of one record, and the number of fields in it
+    """
+    width = max(len(fields) for _, fields in events)
+    return struct.Struct('=Ii{}d'.format(width)), width
+
+
+class TraceBuffer:
+    def __init__(self, path, events, capacity):
+        """
+        :param path: the file to write the trace to
+        :param events: list of (event name, field names), an event's type is its index in this
+        :param capacity: the most events kept between drains
+        """
+        self.events = events
+        self.record, width = record_format(events)
+        self.padding = [(0,) * (width - n) for n in range(width + 1)]  # by the number of fields given
+        self.capacity = capacity
+        self.data = bytearray(self.record.size * capacity)
+        self.offset = 0
+        self.turn = 0
+        self.dropped = 0
+
+        header = json.dumps(events).encode()
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + struct.pack('=I', len(header)) + header)
+
+    def add(self, event, *fields):
+        """
+        Records an event this turn. Fields left out are 0.
+        :param event: the type of the event
+        :param fields: numbers
+        :return:
+        """
+        if self.offset == len(self.data):
+            self.dropped += 1
+            return
+        self.record.pack_into(self.data, self.offset, event, self.turn, *fields, *self.padding[len(fields)])
+        self.offset += self.record.size
+
+    def drain(self):
+        """
+        Writes out the events recorded since the last drain.
+        :return:
+        """
+        self.file.write(memoryview(self.data)[:self.offset])
+        self.file.flush()
+        self.offset = 0
+        if self.dropped > 0:
+            logging.warning('trace: dropped {} events on turn {}'.format(self.dropped, self.turn))
+            self.dropped = 0
+
+    def close(self):
+        self.drain()
+        self.file.close()
+
+
+def read(path):
+    """
+    :param path: a trace file
+    :return: generator of dicts of the event name, turn & fields of each record
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a trace')
+    header_length, = struct.unpack_from('=I', data, len(MAGIC))
+    offset = len(MAGIC) + 4
+    events = json.loads(data[offset:offset + header_length].decode())
+    offset += header_length
+
+    record, _ = record_format(events)
+    end = offset + (len(data) - offset) // record.size * record.size
+    for event, turn, *values in record.iter_unpack(data[offset:end]):
+        name, fields = events[event]
+        decoded = {'event': name, 'turn': turn}
+        decoded.update((field, int(value) if value.is_integer() else value) for field, value in zip(fields, values))
+        yield decoded
+
+
+if __name__ == '__main__':
+    for decoded in read(sys.argv[1]):
+        print(json.dumps(decoded))
@@ -0,0 +1,440 @@
+"""
+Self-play between revisions of the bot, e.g. the working copy against the last one:
+
+    python tournament.py MyBot.py MyBot_last.py --sizes 32 40 48 56 64 --players 2 4 --games 5 --workers 8
+
+Like full_test.py, each game is played once with the candidate in each seat and the baseline in the rest, on the same
+seed, and the candidate's mean rank is compared with the baseline's. Unlike full_test.py there's no halite.exe: the
+engine and the bots all run in one process. Each turn's hlt.networking.Frame is handed to every bot's Commander, and
+the commands it encodes come straight back, so nothing is formatted, piped or parsed besides the commands, and the
+bots' startup (the static tables) is paid once per process rather than once per game. Games are spread over a pool of
+worker processes.
+
+The engine here is a small reimplementation of the Halite III rules (moving, mining & inspiration, spawning, dropoffs,
+collisions), close enough to compare revisions with but not to reproduce the real engine's games.
+
+A bot is the path of a revision of MyBot.py, optionally with settings to play it with:
+
+    python tournament.py 'MyBot.py@{"PLANNING_WINDOW": 12}' MyBot.py
+
+Every revision is imported into the same process, so they all use this hlt package, and need BotContext & Commander's
+send argument.
+
+The bots' traces (see TRACE in MyBot) are turned on with --traces, or by a bot's settings.
+
+Leave out the baseline to check that no seat has an advantage: the candidate plays itself, once per seed, and each
+seat's mean share of the halite has to be within SEAT_TOLERANCE of an equal share, or within SEAT_STANDARD_ERRORS
+standard errors of it. Identical bots still play differently from each seat, since they break ties by position, so it
+takes a few games.
+
+    python tournament.py MyBot.py --sizes 32 40 --players 2 4 --games 5
+"""
+import argparse
+import datetime
+import functools
+import gc
+import importlib.util
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from statistics import mean, stdev
+
+import hlt
+from hlt import commands
+from hlt.networking import Frame, GameStart
+from benchmark import CONSTANTS, generate_halite, max_turns, shipyards
+
+STARTING_HALITE = 5000  # each player's bank at the start of the game
+SEAT_TOLERANCE = 0.05  # how far off an equal share of the halite a seat's mean share can be, relative to it
+SEAT_STANDARD_ERRORS = 2  # ...unless it's within this many standard errors, identical bots' games vary that much
+DIRECTIONS = {
+    commands.NORTH.encode(): (0, -1),
+    commands.SOUTH.encode(): (0, 1),
+    commands.EAST.encode(): (1, 0),
+    commands.WEST.encode(): (-1, 0),
+    commands.STAY_STILL.encode(): (0, 0),
+}
+GENERATE = commands.GENERATE.encode()
+CONSTRUCT = commands.CONSTRUCT.encode()
+
+BOTS = {}  # path -> the module of that revision, imported once per process
+
+
+def generate_map(size, players, seed):
+    """
+    :param size: the width & height of the map
+    :param players: 2 or 4
+    :param seed:
+    :return: the halite on the map as a list of rows (see benchmark.generate_halite), and the (x, y) of each player's
+    shipyard
+    """
+    grid = generate_halite(size, players, random.Random(seed))
+    yards = shipyards(size, players)
+    for x, y in yards:
+        grid[y][x] = 0
+    return grid, yards
+
+
+class Engine:
+    def __init__(self, size, players, seed):
+        """
+        :param size: the width & height of the map
+        :param players: the number of players
+        :param seed: for the map
+        """
+        self.size = size
+        self.constants = dict(CONSTANTS, MAX_TURNS=max_turns(size))
+        self.halite, self.shipyards = generate_map(size, players, seed)
+        self.banks = [STARTING_HALITE] * players
+        self.ships = [{} for _ in range(players)]  # by player: ship id -> [x, y, halite]
+        self.dropoffs = [{} for _ in range(players)]  # by player: dropoff id -> (x, y)
+        self.structures = {pos: player for player, pos in enumerate(self.shipyards)}  # (x, y) -> owner
+        self.changed = set()  # cells whose halite changed since the last frame
+        self.next_id = 0
+        self.turn = 0
+
+        radius = self.constants['INSPIRATION_RADIUS']
+        self.inspiration_offsets = [(dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)
+                                    if abs(dx) + abs(dy) <= radius]
+
+    def start(self, player):
+        """
+        :param player:
+        :return: the GameStart the engine would send to the player
+        """
+        return GameStart(self.constants, len(self.banks), player,
+                         [(i, x, y) for i, (x, y) in enumerate(self.shipyards)], self.size, self.size,
+                         [row[:] for row in self.halite])
+
+    def frame(self):
+        """
+        Starts the next turn.
+        :return: the Frame the engine would send to every player
+        """
+        self.turn += 1
+        players = [(player, self.banks[player],
+                    [(ship_id, x, y, halite) for ship_id, (x, y, halite) in self.ships[player].items()],
+                    [(dropoff_id, x, y) for dropoff_id, (x, y) in self.dropoffs[player].items()])
+                   for player in range(len(self.banks))]
+        cells = [(x, y, self.halite[y][x]) for x, y in self.changed]
+        self.changed = set()
+        return Frame(self.turn, players, cells)
+
+    @staticmethod
+    def parse(data):
+        """
+        :param data: a player's commands for the turn, as encoded by the bot
+        :return: whether they spawn, ids of ships making dropoffs, ship id -> direction
+        """
+        tokens = data.split()
+        spawn = False
+        constructs = set()
+        moves = {}
+        i = 0
+        while i < len(tokens):
+            if tokens[i] == GENERATE:
+                spawn = True
+                i += 1
+            elif tokens[i] == CONSTRUCT:
+                constructs.add(int(tokens[i + 1]))
+                i += 2
+            else:
+                moves[int(tokens[i + 1])] = tokens[i + 2]
+                i += 3
+        return spawn, constructs, moves
+
+    def step(self, turn_commands):
+        """
+        Plays out the turn. Collisions are only resolved once every player has moved, and the players are taken in
+        turn from a different one each turn, so the new ships & dropoffs of no seat are always numbered first.
+        :param turn_commands: each player's commands, as encoded by the bot
+        :return:
+        """
+        size = self.size
+        players = len(turn_commands)
+        occupants = {}  # (x, y) -> [(player, ship id)]
+        stayed = set()  # (player, ship id) of ships that didn't move, and so mine
+        for player in ((self.turn + i) % players for i in range(players)):
+            spawn, constructs, moves = Engine.parse(turn_commands[player])
+            ships = self.ships[player]
+            for ship_id in list(ships):
+                x, y, halite = ships[ship_id]
+                if ship_id in constructs and (x, y) not in self.structures:
+                    cost = self.constants['DROPOFF_COST'] - halite - self.halite[y][x]
+                    if self.banks[player] >= cost:
+                        self.banks[player] -= cost
+                        self.halite[y][x] = 0
+                        self.changed.add((x, y))
+                        self.dropoffs[player][self.next_id] = (x, y)
+                        self.structures[(x, y)] = player
+                        self.next_id += 1
+                        del ships[ship_id]
+                        continue
+                dx, dy = DIRECTIONS[moves.get(ship_id, commands.STAY_STILL.encode())]
+                move_cost = self.halite[y][x] // self.constants['MOVE_COST_RATIO']
+                if (dx or dy) and halite >= move_cost:
+                    ships[ship_id] = [(x + dx) % size, (y + dy) % size, halite - move_cost]
+                else:
+                    stayed.add((player, ship_id))
+                occupants.setdefault(tuple(ships[ship_id][:2]), []).append((player, ship_id))
+
+            if spawn and self.banks[player] >= self.constants['NEW_ENTITY_ENERGY_COST']:
+                self.banks[player] -= self.constants['NEW_ENTITY_ENERGY_COST']
+                x, y = self.shipyards[player]
+                ships[self.next_id] = [x, y, 0]
+                occupants.setdefault((x, y), []).append((player, self.next_id))
+                self.next_id += 1
+
+        for (x, y), ships in occupants.items():
+            if len(ships) > 1:
+                halite = sum(self.ships[player].pop(ship_id)[2] for player, ship_id in ships)
+                if (x, y) in self.structures:
+                    self.banks[self.structures[(x, y)]] += halite
+                else:
+                    self.halite[y][x] += halite
+                    self.changed.add((x, y))
+
+        self.mine(stayed)
+
+    def mine(self, stayed):
+        """
+        Ships on their own structures drop off their halite, and ships that didn't move mine.
+        :param stayed: (player, ship id) of ships that didn't move
+        :return:
+        """
+        size = self.size
+        players = len(self.banks)
+        capacity = self.constants['MAX_ENERGY']
+
+        # (x, y) -> the number of each player's ships within the inspiration radius
+        nearby = {}
+        for player, ships in enumerate(self.ships):
+            for x, y, _ in ships.values():
+                for dx, dy in self.inspiration_offsets:
+                    counts = nearby.setdefault(((x + dx) % size, (y + dy) % size), [0] * players)
+                    counts[player] += 1
+
+        for player, ships in enumerate(self.ships):
+            for ship_id, ship in ships.items():
+                x, y, halite = ship
+                if self.structures.get((x, y)) == player:
+                    self.banks[player] += halite
+                    ship[2] = 0
+                elif (player, ship_id) in stayed:
+                    extracted = min(math.ceil(self.halite[y][x] / self.constants['EXTRACT_RATIO']), capacity - halite)
+                    if extracted <= 0:
+                        continue
+                    self.halite[y][x] -= extracted
+                    self.changed.add((x, y))
+                    counts = nearby[(x, y)]
+                    if sum(counts) - counts[player] >= self.constants['INSPIRATION_SHIP_COUNT']:
+                        extracted += int(extracted * self.constants['INSPIRED_BONUS_MULTIPLIER'])
+                    ship[2] = min(capacity, halite + extracted)
+
+
+def parse_bot(spec):
+    """
+    :param spec: the path of a revision of MyBot.py, optionally followed by @ & a JSON dict of its settings
+    :return: path, settings
+    """
+    path, _, config = spec.partition('@')
+    return os.path.abspath(path), json.loads(config) if config else {}
+
+
+def load_bot(path):
+    """
+    Imports a revision of MyBot.py under its own name, so revisions don't share globals.
+    :param path:
+    :return: the module
+    """
+    if path not in BOTS:
+        spec = importlib.util.spec_from_file_location('bot{}'.format(len(BOTS)), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        BOTS[path] = module
+    return BOTS[path]
+
+
+class Seat:
+    def __init__(self, spec, start, trace_path=None):
+        """
+        Starts a bot in a game.
+        :param spec: see parse_bot
+        :param start: the GameStart for the bot
+        :param trace_path: where the bot writes its trace, which turns tracing on, or None to turn it off
+        """
+        path, config = parse_bot(spec)
+        config = dict({'TRACE': trace_path is not None}, **config)
+        bot = load_bot(path)
+        self.sent = None
+        self.seconds = 0
+        self.max_seconds = 0
+
+        started = time.perf_counter()
+        # the BotContext has to be made right after the hlt.Game, while hlt.constants are this game's
+        context = bot.BotContext(hlt.Game(start), config=config, trace_path=trace_path)
+        self.commander = bot.Commander(context, send=self.send)
+        self.startup_seconds = time.perf_counter() - started
+
+    def send(self, data):
+        self.sent = data
+
+    def play(self, frame):
+        """
+        :param frame:
+        :return: the bot's commands for the turn, encoded
+        """
+        started = time.perf_counter()
+        self.commander.run_once(frame)
+        elapsed = time.perf_counter() - started
+        self.seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        return self.sent
+
+    def close(self):
+        """
+        Ends the bot's game, so it can be collected, see BotContext.close.
+        :return:
+        """
+        self.commander.context.close()
+        self.commander = None
+
+
+def play_game(game, traces=None):
+    """
+    :param game: (map size, seed, the spec of the bot in each seat, the candidate's seat)
+    :param traces: a directory to write each seat's trace to, as trace-<size>-<seed>-<candidate's seat>-<seat>.bin
+    :return: game, each seat's halite at the end, and each seat's startup, total & slowest turn seconds
+    """
+    size, seed, specs, candidate = game
+    engine = Engine(size, len(specs), seed)
+    seats = [Seat(spec, engine.start(player), None if traces is None else os.path.join(
+        traces, 'trace-{}-{}-{}-{}.bin'.format(size, seed, candidate, player))) for player, spec in enumerate(specs)]
+    for _ in range(engine.constants['MAX_TURNS']):
+        frame = engine.frame()
+        engine.step([seat.play(frame) for seat in seats])
+    times = [(seat.startup_seconds, seat.seconds, seat.max_seconds) for seat in seats]
+
+    # the bots keep the garbage collector off, so free the game before the next
+    for seat in seats:
+        seat.close()
+    del seats
+    gc.collect()
+    return game, engine.banks, times
+
+
+def start_worker():
+    # hlt.Game logs to bot-<id>.log unless logging is already set up. only the bots' warnings are kept
+    logging.basicConfig(level=logging.WARNING)
+
+
+def schedule(candidate, baseline, sizes, players, games, seed):
+    """
+    :param baseline: None to play the candidate in every seat, once per seed
+    :return: list of (map size, seed, the spec of the bot in each seat, the candidate's seat), the candidate in each
+    seat of each game. the seat is kept rather than looked up by spec, since the candidate & baseline can be the same
+    """
+    rng = random.Random(seed)
+    scheduled = []
+    for size in sizes:
+        for num_players in players:
+            for _ in range(games):
+                game_seed = rng.getrandbits(32)
+                if baseline is None:
+                    scheduled.append((size, game_seed, (candidate,) * num_players, 0))
+                    continue
+                for seat in range(num_players):
+                    specs = [baseline] * (num_players - 1)
+                    specs.insert(seat, candidate)
+                    scheduled.append((size, game_seed, tuple(specs), seat))
+    return scheduled
+
+
+def rank(banks, seat):
+    """
+    :return: the number of other players the seat has more halite than
+    """
+    return sum(int(banks[seat] > halite) for i, halite in enumerate(banks) if i != seat)
+
+
+def seat_shares(results, num_players):
+    """
+    :param results: as main writes them to --out
+    :param num_players:
+    :return: each seat's mean share of the halite at the end of the games with num_players, & its standard error
+    """
+    games = [result['halite'] for result in results if len(result['halite']) == num_players]
+    shares = []
+    for seat in range(num_players):
+        seat_shares = [banks[seat] / max(sum(banks), 1) for banks in games]
+        error = stdev(seat_shares) / math.sqrt(len(games)) if len(games) > 1 else math.inf
+        shares.append((mean(seat_shares), error))
+    return shares
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('candidate', help='the revision being tested, path[@{settings}]')
+    parser.add_argument('baseline', nargs='?', help='the revision to play against, path[@{settings}], or none to '
+                                                    'check no seat has an advantage')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 40, 48, 56, 64])
+    parser.add_argument('--players', type=int, nargs='+', default=[2, 4], choices=[2, 4])
+    parser.add_argument('--games', type=int, default=5, help='seeds per map size & number of players')
+    parser.add_argument('--workers', type=int, default=0, help='processes to play games in, 0 for one per core')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out', help='write each game\'s results here as JSON')
+    parser.add_argument('--traces', help='a directory to write the bots\' traces to')
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.getrandbits(32)
+    games = schedule(args.candidate, args.baseline, args.sizes, args.players, args.games, seed)
+    print(datetime.datetime.now(), 'seed', seed, len(games), 'games')
+
+    if args.traces:
+        os.makedirs(args.traces, exist_ok=True)
+
+    ranks = {num_players: [] for num_players in args.players}
+    results = []
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.workers or None, start_worker) as pool:
+        play = functools.partial(play_game, traces=args.traces and os.path.abspath(args.traces))
+        for (size, game_seed, specs, seat), banks, times in pool.imap_unordered(play, games):
+            ranks[len(specs)].append(rank(banks, seat))
+            results.append({'size': size, 'seed': game_seed, 'bots': specs, 'candidate_seat': seat, 'halite': banks,
+                            'seconds': times})
+            print(datetime.datetime.now(), len(specs), size, game_seed, 'seat', seat, banks,
+                  'rank', ranks[len(specs)][-1], 'turn {:.3f}s max {:.3f}s'.format(
+                      times[seat][1] / max_turns(size), times[seat][2]))
+    elapsed = time.perf_counter() - started
+
+    unbalanced = []
+    for num_players, candidate_ranks in ranks.items():
+        if args.baseline is None:
+            shares = seat_shares(results, num_players)
+            print('{}p: seats\' shares {} ({} games)'.format(
+                num_players, ' '.join('{:.3f}±{:.3f}'.format(share, error) for share, error in shares),
+                len(candidate_ranks)))
+            if any(abs(share * num_players - 1) > SEAT_TOLERANCE and
+                   abs(share - 1 / num_players) > SEAT_STANDARD_ERRORS * error for share, error in shares):
+                unbalanced.append(num_players)
+            continue
+        # the baseline's seats rank (num_players - 1) / 2 on average when the candidate does too
+        print('{}p: candidate {:.3f} baseline {:.3f} ({} games)'.format(
+            num_players, mean(candidate_ranks), (num_players - 1) / 2, len(candidate_ranks)))
+    print('{:.0f} games/hour'.format(len(games) * 3600 / elapsed))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'seed': seed, 'candidate': args.candidate, 'baseline': args.baseline, 'games': results}, f,
+                      indent=2)
+    if unbalanced:
+        sys.exit('a seat has an advantage in {}p games'.format(' & '.join(map(str, unbalanced))))
+
+
+if __name__ == '__main__':
+    main()